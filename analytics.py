@@ -0,0 +1,327 @@
+import datetime
+import io
+import os
+import threading
+
+import hostlock
+
+# NumPy is imported in the methods that use it, so that the app starts
+# without paying for it until the history is first used.
+
+GROUPS = ("train", "route", "hour", "weekday")
+PERCENTILES = (50, 90)
+
+
+class DelayHistory:
+    """
+    Keeps the outcome of every journey seen by a scan, on time or not, so
+    that delays can be analysed over long periods.
+
+    Journeys are stored column by column in one .npz file per departure day,
+    which keeps months of history small on disk and lets statistics be
+    computed with vectorised NumPy operations instead of Python loops. Days
+    are loaded lazily and kept in memory until their file changes.
+    """
+
+    def __init__(self, path, tz):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.tz = tz
+        self.lock = threading.Lock()
+        # Days are merged and rewritten by whichever process records them.
+        self.write_lock = hostlock.HostLock(os.path.join(path, ".lock"))
+        self.days = {}
+
+    def _file(self, day):
+        return os.path.join(self.path, f"{day.isoformat()}.npz")
+
+    def _load(self, day):
+        """Returns the columns stored for a day, or None if there are none."""
+        import numpy as np
+
+        path = self._file(day)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        cached = self.days.get(day)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with np.load(path) as data:
+            columns = {name: data[name] for name in data.files}
+        self.days[day] = (mtime, columns)
+        return columns
+
+    def _save(self, day, rows):
+        import numpy as np
+
+        stations = sorted({row[1] for row in rows} | {row[2] for row in rows})
+        index = {station: i for i, station in enumerate(stations)}
+        departures = [row[3] for row in rows]
+        local = [datetime.datetime.fromtimestamp(ts, self.tz) for ts in departures]
+
+        buf = io.BytesIO()
+        np.savez(
+            buf,
+            stations=np.array(stations, dtype=str),
+            train=np.array([row[0] for row in rows], dtype=np.int32),
+            from_station=np.array([index[row[1]] for row in rows], dtype=np.int16),
+            to_station=np.array([index[row[2]] for row in rows], dtype=np.int16),
+            departure=np.array(departures, dtype=np.int64),
+            hour=np.array([dt.hour for dt in local], dtype=np.int8),
+            weekday=np.array([dt.weekday() for dt in local], dtype=np.int8),
+            delay=np.array([row[4] for row in rows], dtype=np.float32),
+            canceled=np.array([row[5] for row in rows], dtype=bool),
+        )
+
+        path = self._file(day)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(buf.getvalue())
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _rows(columns):
+        stations = columns["stations"]
+        return {
+            (int(train), str(stations[a]), str(stations[b]), int(ts)): (
+                float(delay),
+                bool(canceled),
+            )
+            for train, a, b, ts, delay, canceled in zip(
+                columns["train"],
+                columns["from_station"],
+                columns["to_station"],
+                columns["departure"],
+                columns["delay"],
+                columns["canceled"],
+            )
+        }
+
+    def record(self, journeys):
+        """
+        Stores journeys as returned by journeys.route_journeys(). Journeys
+        that have neither arrived nor been canceled are skipped until a later
+        scan sees their outcome; a journey seen again replaces the old row.
+        """
+        import numpy as np
+
+        by_day = {}
+        for journey in journeys:
+            if journey["delay"] is None and not journey["canceled"]:
+                continue
+            try:
+                train = int(journey["ticket"])
+            except (TypeError, ValueError):
+                continue
+
+            departure = journey["departure"].astimezone(self.tz)
+            key = (train, journey["from"], journey["to"], int(departure.timestamp()))
+            delay = float("nan") if journey["canceled"] else journey["delay"]
+            by_day.setdefault(departure.date(), {})[key] = (
+                delay,
+                journey["canceled"],
+            )
+
+        with self.write_lock, self.lock:
+            for day, new in by_day.items():
+                columns = self._load(day)
+                rows = self._rows(columns) if columns is not None else {}
+                # Skip the write if every journey is already stored as is
+                changed = {
+                    key: value
+                    for key, value in new.items()
+                    if key not in rows
+                    or rows[key][1] != value[1]
+                    or (not value[1] and rows[key][0] != np.float32(value[0]))
+                }
+                if not changed:
+                    continue
+                merged = dict(rows)
+                merged.update(changed)
+                self._save(day, [key + value for key, value in sorted(merged.items())])
+
+    def columns(self, start, end):
+        """Returns the concatenated columns for the days start..end inclusive."""
+        import numpy as np
+
+        parts = []
+        with self.lock:
+            day = start
+            while day <= end:
+                columns = self._load(day)
+                if columns is not None and len(columns["train"]):
+                    parts.append(
+                        columns
+                        | {"day": np.full(len(columns["train"]), day.toordinal())}
+                    )
+                day += datetime.timedelta(days=1)
+
+        stations = sorted({str(s) for part in parts for s in part["stations"]})
+        result = {"stations": np.array(stations, dtype=str)}
+        names = ("train", "hour", "weekday", "delay", "canceled", "departure", "day")
+        for name in names:
+            result[name] = (
+                np.concatenate([part[name] for part in parts])
+                if parts
+                else np.array([])
+            )
+
+        # Station codes are per file; map them into the combined station list
+        for name in ("from_station", "to_station"):
+            result[name] = (
+                np.concatenate(
+                    [
+                        np.searchsorted(result["stations"], part["stations"])[
+                            part[name]
+                        ]
+                        for part in parts
+                    ]
+                )
+                if parts
+                else np.array([], dtype=np.int64)
+            )
+        return result
+
+    @staticmethod
+    def _runs(keys, train, day, departure, delay, canceled):
+        """
+        Collapses the rows of each train run, a train ident on a departure
+        day, into one. A run is canceled if any of its journeys was, and
+        otherwise delayed by the largest arrival delay of its journeys; its
+        group key is that of its earliest departure. Returns the keys, delays
+        and canceled flags of the runs.
+        """
+        import numpy as np
+
+        run = day.astype(np.int64) << 32 | train.astype(np.int64)
+        runs, inverse = np.unique(run, return_inverse=True)
+        n = len(runs)
+
+        first = np.lexsort((departure, inverse))
+        starts = np.searchsorted(inverse[first], np.arange(n))
+        run_keys = keys[first[starts]]
+
+        run_canceled = np.bincount(inverse, weights=canceled, minlength=n) > 0
+        run_delay = np.full(n, np.nan)
+        np.fmax.at(run_delay, inverse, delay)
+        run_delay[run_canceled] = np.nan
+        return run_keys, run_delay, run_canceled
+
+    def stats(
+        self,
+        start,
+        end,
+        group,
+        rules,
+        operator,
+        from_station=None,
+        to_station=None,
+        train=None,
+    ):
+        """
+        Delay statistics for the days start..end, grouped by train ident,
+        route, departure hour or weekday (0 is Monday). Delays are arrival
+        delays in minutes; canceled journeys count towards canceled but not
+        towards the delay figures. Journeys are eligible if `rules`, an
+        EligibilityRules, give them a tier with `operator`. Deviations are
+        not kept in the history, so rules on them never match here.
+
+        The history has a row per station pair a train covers. Route groups
+        count those rows; the other groups count each train once per
+        departure day, see _runs().
+        """
+        import numpy as np
+
+        if group not in GROUPS:
+            raise ValueError(f"group must be one of {', '.join(GROUPS)}")
+
+        cols = self.columns(start, end)
+        stations = cols["stations"]
+        mask = np.ones(len(cols["train"]), dtype=bool)
+        for name, value in (("from_station", from_station), ("to_station", to_station)):
+            if value is not None:
+                i = np.searchsorted(stations, value)
+                code = i if i < len(stations) and stations[i] == value else -1
+                mask &= cols[name] == code
+        if train is not None:
+            mask &= cols["train"] == train
+
+        delay = cols["delay"][mask].astype(np.float64)
+        canceled = cols["canceled"][mask].astype(bool)
+        if group == "route":
+            keys = (
+                cols["from_station"][mask] * max(len(stations), 1)
+                + cols["to_station"][mask]
+            )
+        else:
+            keys, delay, canceled = self._runs(
+                cols[group][mask],
+                cols["train"][mask],
+                cols["day"][mask],
+                cols["departure"][mask],
+                delay,
+                canceled,
+            )
+
+        groups, inverse = np.unique(keys, return_inverse=True)
+        n = len(groups)
+        count = np.bincount(inverse, minlength=n)
+        canceled_count = np.bincount(inverse, weights=canceled, minlength=n)
+        tiers = rules.evaluate_columns(canceled, delay)[operator]
+        eligible = np.bincount(
+            inverse, weights=np.not_equal(tiers, None), minlength=n
+        )
+
+        arrived = ~np.isnan(delay)
+        arrived_inverse = inverse[arrived]
+        arrived_delay = delay[arrived]
+        arrived_count = np.bincount(arrived_inverse, minlength=n)
+        delay_sum = np.bincount(arrived_inverse, weights=arrived_delay, minlength=n)
+
+        # Sort delays within each group, then pick percentiles by position
+        order = np.lexsort((arrived_delay, arrived_inverse))
+        sorted_delay = arrived_delay[order]
+        offsets = (
+            np.concatenate(([0], np.cumsum(arrived_count)[:-1])) if n else np.array([])
+        )
+        percentiles = {}
+        for p in PERCENTILES:
+            pos = offsets + (p / 100) * np.maximum(arrived_count - 1, 0)
+            lo = np.floor(pos).astype(np.int64)
+            hi = np.ceil(pos).astype(np.int64)
+            if len(sorted_delay):
+                lo_val = sorted_delay[np.minimum(lo, len(sorted_delay) - 1)]
+                hi_val = sorted_delay[np.minimum(hi, len(sorted_delay) - 1)]
+                percentiles[p] = lo_val + (hi_val - lo_val) * (pos - lo)
+            else:
+                percentiles[p] = np.zeros(n)
+
+        results = []
+        for i, key in enumerate(groups):
+            if group == "route":
+                a, b = divmod(int(key), max(len(stations), 1))
+                label = f"{stations[a]}-{stations[b]}"
+            else:
+                label = int(key)
+            has_delay = arrived_count[i] > 0
+            entry = {
+                "key": label,
+                "journeys": int(count[i]),
+                "canceled": int(canceled_count[i]),
+                "eligible": int(eligible[i]),
+                "eligibleShare": round(float(eligible[i] / count[i]), 3),
+                "meanDelay": (
+                    round(float(delay_sum[i] / arrived_count[i]), 1)
+                    if has_delay
+                    else None
+                ),
+            }
+            for p in PERCENTILES:
+                entry[f"p{p}Delay"] = (
+                    round(float(percentiles[p][i]), 1) if has_delay else None
+                )
+            results.append(entry)
+        return results
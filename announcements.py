@@ -0,0 +1,289 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import httpclient
+import journeys
+import metrics
+
+
+FIELDS = [
+    "ActivityId",
+    "AdvertisedTrainIdent",
+    "AdvertisedTimeAtLocation",
+    "TimeAtLocation",
+    "LocationSignature",
+    "Operator",
+    "Canceled",
+    "ActivityType",
+    "Deviation",
+]
+
+# A day is considered final once it has been synced this long after it ended,
+# after which it is never queried upstream again.
+SETTLE_TIME = datetime.timedelta(hours=6)
+
+# Windows are not split further than this when a query hits the row limit.
+MIN_WINDOW = datetime.timedelta(minutes=15)
+
+# Change ID recorded for a window that has been split into two halves.
+SPLIT = "split"
+
+
+class AnnouncementStore:
+    """
+    A local SQLite copy of Trafikverket TrainAnnouncement rows.
+
+    Rows are synced per day and set of stations. The first sync of a day
+    downloads every row; later syncs pass the change ID returned by the API so
+    that only new or changed rows are sent. Days with more rows than the API
+    returns in one answer are split into smaller windows. Queries for any time
+    window are then answered from the local table.
+    """
+
+    def __init__(self, path, operator="TDEV", limit=1000, workers=4):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.operator = operator
+        self.limit = limit
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS announcements (
+                activity_id TEXT PRIMARY KEY,
+                train TEXT,
+                location TEXT,
+                activity TEXT,
+                advertised TEXT,
+                advertised_ts REAL,
+                time_at_location TEXT,
+                canceled INTEGER,
+                operator TEXT,
+                deviation TEXT
+            );
+            CREATE INDEX IF NOT EXISTS announcements_location_time
+                ON announcements (location, advertised_ts);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                scope TEXT PRIMARY KEY,
+                change_id TEXT,
+                synced_at REAL
+            );
+            """
+        )
+        columns = self.db.execute("PRAGMA table_info(announcements)").fetchall()
+        if "deviation" not in [column[1] for column in columns]:
+            # Stores created before deviations were kept; sync every day
+            # again from scratch so that existing rows get them too.
+            self.db.execute("ALTER TABLE announcements ADD COLUMN deviation TEXT")
+            self.db.execute("DELETE FROM sync_state")
+        self.db.commit()
+
+    def fetch(self, tv_api_key, stations, start_time, end_time, tz):
+        """
+        Brings the store up to date for the days covering the window and
+        returns the announcements at `stations` advertised strictly between
+        `start_time` and `end_time`, in the Trafikverket response format.
+        Days are synced in parallel, so multi-day windows cost about as much
+        as a single day.
+        """
+        for _ in self.iter_sync(tv_api_key, stations, start_time, end_time, tz):
+            pass
+
+        return self.query(stations, start_time, end_time)
+
+    def iter_sync(self, tv_api_key, stations, start_time, end_time, tz):
+        """
+        Syncs the days covering the window like fetch() and yields, as soon as
+        each day and every day before it are in the store, the time up to
+        which the window can be queried: the end of that day, or `end_time`.
+        """
+        days = []
+        day = start_time.astimezone(tz).date()
+        while day <= end_time.astimezone(tz).date():
+            days.append(day)
+            day += datetime.timedelta(days=1)
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(days))) as pool:
+            synced = pool.map(
+                metrics.in_trace(
+                    lambda day: self.sync_day(tv_api_key, stations, day, tz)
+                ),
+                days,
+            )
+            for day_end in synced:
+                yield min(day_end, end_time)
+
+    def sync_day(self, tv_api_key, stations, day, tz):
+        """Syncs one day and returns its end."""
+        day_start = tz.localize(datetime.datetime.combine(day, datetime.time.min))
+        day_end = tz.localize(
+            datetime.datetime.combine(
+                day + datetime.timedelta(days=1), datetime.time.min
+            )
+        )
+        self._sync_window(tv_api_key, stations, day_start, day_end)
+        return day_end
+
+    def _sync_window(self, tv_api_key, stations, start_time, end_time):
+        scope = (
+            f"{start_time.isoformat()}/{end_time.isoformat()}:"
+            f"{','.join(sorted(stations))}"
+        )
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT change_id, synced_at FROM sync_state WHERE scope = ?",
+                (scope,),
+            ).fetchone()
+        change_id, synced_at = row if row else ("0", None)
+
+        if change_id == SPLIT:
+            return self._sync_halves(tv_api_key, stations, start_time, end_time)
+
+        if synced_at is not None and synced_at > (end_time + SETTLE_TIME).timestamp():
+            return
+
+        anns, last_change_id = self._page(
+            tv_api_key, stations, start_time, end_time, change_id
+        )
+
+        # A full page means the answer was cut off at the limit. The window is
+        # then split in two and each half is synced on its own from now on.
+        # A window that cannot be split any further is read page by page.
+        truncated = len(anns) >= self.limit and end_time - start_time > MIN_WINDOW
+        if truncated:
+            last_change_id = SPLIT
+        elif len(anns) >= self.limit:
+            print(
+                f"More than {self.limit} announcements between {start_time.isoformat()}"
+                f" and {end_time.isoformat()}, reading them in pages; raise TV_QUERY_LIMIT"
+            )
+            page = anns
+            while len(page) >= self.limit:
+                page, _ = self._page(
+                    tv_api_key, stations, start_time, end_time, change_id, len(anns)
+                )
+                anns = anns + page
+        change_id = last_change_id
+
+        with self.lock:
+            self._upsert(anns)
+            self.db.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)",
+                (scope, change_id, time.time()),
+            )
+            self.db.commit()
+
+        if truncated:
+            self._sync_halves(tv_api_key, stations, start_time, end_time)
+
+    def _sync_halves(self, tv_api_key, stations, start_time, end_time):
+        middle = start_time + (end_time - start_time) / 2
+        halves = [(start_time, middle), (middle, end_time)]
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            list(
+                pool.map(
+                    metrics.in_trace(
+                        lambda w: self._sync_window(tv_api_key, stations, *w)
+                    ),
+                    halves,
+                )
+            )
+
+    def query(self, stations, start_time, end_time):
+        placeholders = ",".join("?" for _ in stations)
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT activity_id, train, advertised, time_at_location, location,"
+                " operator, canceled, activity, deviation FROM announcements"
+                f" WHERE location IN ({placeholders})"
+                " AND advertised_ts > ? AND advertised_ts < ?"
+                " ORDER BY advertised_ts",
+                (*stations, start_time.timestamp(), end_time.timestamp()),
+            ).fetchall()
+
+        return [
+            {k: v for k, v in zip(FIELDS, row) if v is not None}
+            | {"Canceled": bool(row[6]), "Deviation": json.loads(row[8] or "[]")}
+            for row in rows
+        ]
+
+    def _upsert(self, anns):
+        for ann in anns:
+            if ann.get("Deleted"):
+                self.db.execute(
+                    "DELETE FROM announcements WHERE activity_id = ?",
+                    (ann.get("ActivityId"),),
+                )
+                continue
+            try:
+                advertised_ts = journeys.parse_time(
+                    ann.get("AdvertisedTimeAtLocation")
+                ).timestamp()
+            except Exception:
+                continue
+            self.db.execute(
+                "INSERT OR REPLACE INTO announcements"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    ann.get("ActivityId"),
+                    ann.get("AdvertisedTrainIdent", "N/A"),
+                    ann.get("LocationSignature"),
+                    ann.get("ActivityType"),
+                    ann.get("AdvertisedTimeAtLocation"),
+                    advertised_ts,
+                    ann.get("TimeAtLocation"),
+                    int(ann.get("Canceled", False)),
+                    ann.get("Operator"),
+                    json.dumps(ann.get("Deviation", [])),
+                ),
+            )
+
+    def _page(self, tv_api_key, stations, start_time, end_time, change_id, skip=0):
+        """Returns the announcements of one response and its last change ID."""
+        tv_data = self._request(
+            tv_api_key, stations, start_time, end_time, change_id, skip
+        )
+        result = tv_data.get("RESPONSE", {}).get("RESULT", [{}])[0]
+        return (
+            result.get("TrainAnnouncement", []),
+            result.get("INFO", {}).get("LASTCHANGEID", change_id),
+        )
+
+    def _request(self, tv_api_key, stations, start_time, end_time, change_id, skip=0):
+        locations = "\n".join(
+            f'<EQ name="LocationSignature" value="{s}" />' for s in sorted(stations)
+        )
+        includes = "\n".join(f"<INCLUDE>{f}</INCLUDE>" for f in FIELDS + ["Deleted"])
+        query = f"""
+            <REQUEST>
+              <LOGIN authenticationkey="{tv_api_key}" />
+              <QUERY objecttype="TrainAnnouncement" schemaversion="1.9" limit="{self.limit}"
+                     skip="{skip}" orderby="AdvertisedTimeAtLocation"
+                     changeid="{change_id}" includedeletedobjects="true">
+                <FILTER>
+                  <GTE name="AdvertisedTimeAtLocation" value="{start_time.isoformat()}" />
+                  <LT name="AdvertisedTimeAtLocation" value="{end_time.isoformat()}" />
+                  <EQ name="Operator" value="{self.operator}" />
+                  <OR>
+                    {locations}
+                  </OR>
+                </FILTER>
+                {includes}
+              </QUERY>
+            </REQUEST>
+        """
+        response = httpclient.post(
+            config.tv_api_url,
+            data=query.encode("utf-8"),
+            headers={"Content-Type": "text/xml"},
+        )
+        response.raise_for_status()
+        return response.json()
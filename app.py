@@ -7,12 +7,33 @@ from flask import (
     make_response,
     send_from_directory,
     jsonify,
+    stream_with_context,
 )
-from dateutil import parser
+import csv
 import datetime
+import hmac
+import io
+import json
+import os
+import threading
+import time
 import pytz
-import requests
+import analytics
+import announcements
 import operators
+import profiles
+import ratelimit
+import rules
+import httpclient
+import jobs
+import journeys
+import ledger
+import metrics
+import scheduler
+import stations
+import batch
+import cache
+import config
 
 app = Flask(__name__)
 
@@ -20,6 +41,88 @@ tz = pytz.timezone("Europe/Stockholm")
 
 debug_mode = False
 
+ARRIVAL_STATIONS = {
+    "U": ["Cst", "Srv", "Kn", "Mr", "Fvk", "Gä"],
+    "Kn": ["U", "Cst", "Mr"],
+    "Mr": ["U", "Cst", "Kn"],
+    "Cst": ["U", "Kn", "Mr"],
+    "Srv": ["U", "Fvk", "Gä"],
+}
+
+# Every station pair that can be chosen in the form, in one direction only;
+# delay scans check both directions.
+ROUTES = sorted(
+    {tuple(sorted((a, b))) for a, bs in ARRIVAL_STATIONS.items() for b in bs}
+)
+
+# Local copy of the Trafikverket announcements used for delay scans.
+announcement_store = announcements.AnnouncementStore(
+    os.path.join(config.data_dir, "announcements.db"),
+    limit=config.tv_query_limit,
+    workers=config.tv_fetch_workers,
+)
+
+# Outcome of every scanned journey, for delay statistics.
+delay_history = analytics.DelayHistory(os.path.join(config.data_dir, "history"), tz)
+
+# Which journeys qualify for compensation with each operator.
+eligibility = rules.EligibilityRules.load(config.rules_file)
+
+# Journeys that have already been claimed.
+claim_ledger = ledger.ClaimLedger(os.path.join(config.data_dir, "claims.db"))
+
+# Commuters registered for batch mode.
+profile_store = profiles.ProfileStore(os.path.join(config.data_dir, "profiles.db"))
+
+# Claim submissions are queued and processed by background workers.
+job_queue = jobs.JobQueue(
+    os.path.join(config.data_dir, "jobs.db"),
+    lambda payload, progress, job_id: run_job(payload, progress, job_id),
+    workers=config.job_workers,
+)
+
+# Departure lists per (departure station, arrival station, date).
+departures_cache = cache.TTLCache(
+    config.departures_cache_size,
+    config.departures_cache_ttl,
+    os.path.join(config.data_dir, "cache.db") if config.shared_cache else None,
+    table="departures",
+)
+
+@app.before_request
+def start_trace():
+    if config.trace_requests:
+        metrics.start_trace()
+
+
+@app.after_request
+def end_trace(resp):
+    if config.trace_requests:
+        spans = ", ".join(f"{name}={elapsed * 1000:.1f}ms" for name, elapsed in metrics.end_trace())
+        print(f"TRACE {request.method} {request.path} {resp.status_code} {spans}")
+    return resp
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    resp = make_response(metrics.render())
+    resp.mimetype = "text/plain"
+    return resp
+
+
+@app.route("/api/upstreams", methods=["GET"])
+def get_upstreams():
+    """Current rate limit and circuit breaker state per upstream host."""
+    return jsonify(httpclient.limiter.state())
+
+
+def upstream_error_status(e):
+    # 503 tells the caller to back off while an upstream host is down.
+    if isinstance(e, ratelimit.CircuitOpenError):
+        return 503
+    return 500
+
+
 @app.route("/", methods=["GET"])
 def index():
     resp = make_response(
@@ -52,34 +155,249 @@ def send_static_file(path):
 @app.route("/api/submit", methods=["POST"])
 def submit():
     operator = request.json.get("operator")
-    if operator == "sj":
-        op = operators.SJ()
-    elif operator == "mt":
-        op = operators.MT()
-
-    r = op.submit(
-        request.json.get("ticket"),
-        request.json.get("from"),
-        request.json.get("to"),
-        request.json.get("departureDate"),
-        request.json.get("departureTime"),
-        request.json.get("customer"),
+    if operator not in operators.OPERATORS:
+        return f"Unknown operator: {operator}", 400
+
+    job_id = job_queue.enqueue(
+        {
+            "operator": operator,
+            "items": [
+                {
+                    "ticket": request.json.get("ticket"),
+                    "from": request.json.get("from"),
+                    "to": request.json.get("to"),
+                    "departureDate": request.json.get("departureDate"),
+                    "departureTime": request.json.get("departureTime"),
+                }
+            ],
+            "customer": request.json.get("customer"),
+        }
     )
 
-    if r:
-        resp = make_response("Request submitted!")
+    return jsonify({"status": "queued", "job": job_id, "message": "Request queued"}), 202
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "No such job"}), 404
+
+    return jsonify(job)
+
+
+def run_job(payload, progress=None, job_id=None):
+    if payload.get("kind") == "reconcile":
+        with metrics.timed("reconcile_job"):
+            return claim_ledger.reconcile(
+                config.claim_pending_timeout, progress=progress
+            )
+    return process_submission(payload, progress, job_id)
+
+
+def check_admin_token():
+    """
+    The claim ledger holds every claim and upstream response, so its
+    endpoints are only available when ADMIN_TOKEN is set, and every request
+    must send it in the X-Admin-Token header. Returns an error response, or
+    None.
+    """
+    if not config.admin_token:
+        return jsonify({"status": "error", "message": "Not enabled"}), 404
+    if not hmac.compare_digest(
+        request.headers.get("X-Admin-Token", ""), config.admin_token
+    ):
+        return jsonify({"status": "error", "message": "Invalid admin token"}), 403
+    return None
+
+
+@app.route("/api/claims/reconcile", methods=["POST"])
+def reconcile_claims():
+    """Queues a job settling claims left pending by interrupted submissions."""
+    error = check_admin_token()
+    if error:
+        return error
+
+    job_id = job_queue.enqueue({"kind": "reconcile"})
+    return jsonify({"status": "queued", "job": job_id}), 202
+
+
+@app.route("/api/claims/export", methods=["GET"])
+def export_claims():
+    """
+    Streams the claim attempt log as CSV (format=csv, the default) or
+    newline-delimited JSON (format=json), oldest first. Pass the last id seen
+    as `after` to export only newer attempts, and `operator` to filter.
+    """
+    error = check_admin_token()
+    if error:
+        return error
+
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "json"):
+        return jsonify({"status": "error", "message": "format must be csv or json"}), 400
+    try:
+        after = int(request.args.get("after", 0))
+    except ValueError:
+        return jsonify({"status": "error", "message": "after must be an id"}), 400
+    attempts = claim_ledger.attempts(after, request.args.get("operator"))
+
+    if fmt == "json":
+        return app.response_class(
+            (ndjson(attempt) for attempt in attempts),
+            mimetype="application/x-ndjson",
+        )
+
+    def rows():
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, ledger.ATTEMPT_FIELDS)
+        writer.writeheader()
+        for n, attempt in enumerate(attempts, 1):
+            writer.writerow(attempt)
+            if n % 1000 == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    resp = app.response_class(rows(), mimetype="text/csv")
+    resp.headers["Content-Disposition"] = "attachment; filename=claims.csv"
+    return resp
+
+
+def process_submission(payload, progress=None, job_id=None):
+    """
+    Submits the items of a queued /api/submit or /api/submit_selected job and
+    returns the summary stored as the job result. If given, `progress` is
+    called with the results so far each time an item is done.
+    """
+    with metrics.timed("submission_job"):
+        return _process_submission(payload, progress, job_id)
+
+
+def _process_submission(payload, progress, job_id):
+    operator = payload.get("operator", "mt")
+    op = operators.OPERATORS[operator]
+    # A journey listed twice is only filed once. `first` maps every input
+    # item to the position of its first occurrence in `items`, so that the
+    # results still line up with the input.
+    keys = {}
+    items = []
+    first = []
+    for item in payload["items"]:
+        key = ledger.ClaimLedger.key(operator, item, payload.get("customer"))
+        if key not in keys:
+            keys[key] = len(items)
+            items.append(item)
+        first.append(keys[key])
+    duplicates = len(first) - len(items)
+
+    def per_input(results):
+        seen = set()
+        out = []
+        for i in first:
+            if i in seen and results[i] is not None:
+                out.append({
+                    "ticket": results[i].get("ticket"),
+                    "submitted": False,
+                    "duplicate": True,
+                    "error": None,
+                })
+            else:
+                out.append(results[i])
+            seen.add(i)
+        return out
+    if operator == "mt":
+        # Resolve the train numbers of new claims up front, then submit the
+        # items in parallel. Results come back in input order.
+        op.prefetch_train_numbers(
+            [
+                item
+                for item, filed in zip(
+                    items, claim_ledger.filed(operator, items, payload.get("customer"))
+                )
+                if not filed
+            ]
+        )
+
+    on_result = None
+    if progress is not None:
+        partial = [None] * len(items)
+        lock = threading.Lock()
+
+        def on_result(i, result):
+            with lock:
+                partial[i] = result
+                progress({"status": "running", "results": per_input(partial)})
+
+    results = batch.submit_items(
+        op,
+        items,
+        payload.get("customer"),
+        ledger=claim_ledger,
+        operator=operator,
+        on_result=on_result,
+        job=job_id,
+    )
+    submitted_count = sum(1 for r in results if r["submitted"])
+    skipped_count = sum(1 for r in results if r.get("alreadySubmitted"))
+    errors = [r["error"] for r in results if r["error"]]
+    results = per_input(results)
 
-        return resp
+    if errors:
+        return {
+            "status": "error",
+            "submitted": submitted_count,
+            "message": "Some errors occurred while submitting: " + "; ".join(errors),
+            "errors": errors,
+            "results": results,
+        }
+
+    if skipped_count == len(items):
+        message = "Already submitted."
+    elif len(items) == 1:
+        message = "Request submitted!"
     else:
-        return f"Something went wrong submitting the request: {r.text}", 500
+        message = f"{submitted_count} applications submitted."
+        if skipped_count:
+            message += f" {skipped_count} were already submitted."
+    if duplicates:
+        message += f" {duplicates} were listed twice."
+
+    return {
+        "status": "success",
+        "submitted": submitted_count,
+        "message": message,
+        "results": results,
+    }
 
 
 @app.route(
     "/api/departures/<departure_station>/<arrival_station>/<date>", methods=["GET"]
 )
 def get_departures(departure_station, arrival_station, date):
-    r = requests.get(
-        "https://evf-regionsormland.preciocloudapp.net/api/TrainStations/GetDepartureTimeList",
+    try:
+        departures = departures_cache.get_or_set(
+            (departure_station, arrival_station, date),
+            lambda: fetch_departures(departure_station, arrival_station, date),
+        )
+    except Exception as e:
+        print(e)
+        return jsonify({"status": "error", "message": f"Error retrieving departures: {str(e)}"}), upstream_error_status(e)
+
+    resp = jsonify(departures)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = config.departures_cache_ttl
+    resp.add_etag()
+
+    return resp.make_conditional(request)
+
+
+def fetch_departures(departure_station, arrival_station, date):
+    from dateutil import parser
+
+    r = httpclient.get(
+        f"{config.mt_api_url}/TrainStations/GetDepartureTimeList",
         params={
             "departureStationId": departure_station,
             "arrivalStationId": arrival_station,
@@ -88,8 +406,9 @@ def get_departures(departure_station, arrival_station, date):
             ),
         },
     )
+    r.raise_for_status()
 
-    return jsonify(sorted(r.json()["data"]))
+    return sorted(r.json()["data"])
 
 @app.route("/api/submit_selected", methods=["POST"])
 def submit_selected():
@@ -98,61 +417,174 @@ def submit_selected():
     if not items:
         return jsonify({"status": "error", "message": "No items provided"}), 400
 
-    op = operators.MT()  # Using the MT class as in your submit() route
-    submitted_count = 0
-    errors = []
+    job_id = job_queue.enqueue(
+        {"operator": "mt", "items": items, "customer": data.get("customer")}
+    )
 
-    for item in items:
-        try:
-            # Call op.submit() for each selected item.
-            # It is assumed that each item contains the necessary keys.
-            r = op.submit(
-                item.get("ticket"),
-                item.get("from"),
-                item.get("to"),
-                item.get("departureDate"),
-                item.get("departureTime"),
-                data.get("customer")  # Pass along customer info if available
-            )
-            if r:
-                submitted_count += 1
-            else:
-                errors.append(f"Submission failed for train {item.get('ticket')}")
-        except Exception as e:
-            errors.append(str(e))
+    return jsonify({
+        "status": "queued",
+        "job": job_id,
+        "message": f"{len(items)} applications queued.",
+    }), 202
 
-    if errors:
-        return jsonify({
-            "status": "error",
-            "message": "Some errors occurred while submitting selected items.",
-            "errors": errors
-        }), 500
+@app.route("/api/submit_selected/stream", methods=["POST"])
+def submit_selected_stream():
+    """
+    Same as /api/submit_selected, but waits for the queued job and sends
+    newline-delimited JSON: one {"type": "result"} line per item as soon as it
+    has been submitted, then a {"type": "done"} line with the job result.
+    """
+    data = request.get_json()
+    items = data.get("items", [])
+    if not items:
+        return jsonify({"status": "error", "message": "No items provided"}), 400
+
+    job_id = job_queue.enqueue(
+        {"operator": "mt", "items": items, "customer": data.get("customer")}
+    )
+
+    def generate():
+        yield ndjson({"type": "queued", "job": job_id})
+
+        sent = set()
+        while True:
+            job = job_queue.get(job_id)
+            results = (job["result"] or {}).get("results") or []
+            for i, result in enumerate(results):
+                if result is not None and i not in sent:
+                    sent.add(i)
+                    yield ndjson(
+                        {"type": "result", "index": i, "item": items[i], "result": result}
+                    )
+
+            if job["status"] == jobs.DONE:
+                yield ndjson({"type": "done", **job["result"]})
+                return
+            if job["status"] == jobs.FAILED:
+                yield ndjson({"type": "error", "message": job["error"]})
+                return
+
+            time.sleep(0.1)
+
+    return app.response_class(
+        stream_with_context(generate()), mimetype="application/x-ndjson"
+    )
+
+@app.route("/api/auto_submit", methods=["POST"])
+def auto_submit():
+    try:
+        tv_api_key, routes, start_time, end_time = read_scan_request(request.json)
+    except ValueError as e:
+        return str(e), 400
+
+    try:
+        all_departures = find_delayed_or_cancelled(routes, start_time, end_time, tv_api_key)
+    except Exception as e:
+        print(e)
+        return f"Error retrieving departures: {str(e)}", upstream_error_status(e)
 
+    submission_items = build_submission_items(
+        all_departures, request.json.get("customer")
+    )
+
+    # Instead of submitting automatically here, we return the list so the user can select.
     return jsonify({
         "status": "success",
-        "submitted": submitted_count,
-        "message": f"{submitted_count} applications submitted."
+        "found": len(submission_items),
+        "items": submission_items,
+        "message": scan_message(len(submission_items), start_time, end_time),
     })
 
-@app.route("/api/auto_submit", methods=["POST"])
-def auto_submit():
-    # Read inputs from JSON payload.
-    tv_api_key = request.json.get("tv_api_key", "").strip()
+
+@app.route("/api/auto_submit/stream", methods=["POST"])
+def auto_submit_stream():
+    """
+    Same as /api/auto_submit, but sends newline-delimited JSON: one
+    {"type": "item"} line per delayed or cancelled journey as soon as its
+    day of the window has been synced, then a {"type": "done"} line with
+    the summary.
+    """
+    try:
+        tv_api_key, routes, start_time, end_time = read_scan_request(request.json)
+    except ValueError as e:
+        return str(e), 400
+    customer = request.json.get("customer")
+
+    def generate():
+        found = 0
+        seen = set()
+        try:
+            for departures in iter_delayed_or_cancelled(
+                routes, start_time, end_time, tv_api_key
+            ):
+                for item in build_submission_items(departures, customer):
+                    key = ledger.ClaimLedger.key("mt", item)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    found += 1
+                    yield ndjson({"type": "item", "item": item})
+        except Exception as e:
+            print(e)
+            yield ndjson(
+                {"type": "error", "message": f"Error retrieving departures: {str(e)}"}
+            )
+            return
+
+        yield ndjson(
+            {
+                "type": "done",
+                "status": "success",
+                "found": found,
+                "message": scan_message(found, start_time, end_time),
+            }
+        )
+
+    return app.response_class(
+        stream_with_context(generate()), mimetype="application/x-ndjson"
+    )
+
+
+def ndjson(data):
+    return json.dumps(data) + "\n"
+
+
+def read_scan_request(data, routes=None):
+    """
+    Reads the API key, routes and time window of a delay scan request. Raises
+    ValueError with a message for the user if the request is invalid.
+
+    Unless `routes` are given, as for batch mode, the scan covers the one
+    route picked in the form ("from" and "to", by default U and Cst), so that
+    a traveller is not offered claims for journeys they did not make.
+    """
+    tv_api_key = data.get("tv_api_key", "").strip()
     if not tv_api_key:
-        return "Trafikverket API key not provided", 400
+        raise ValueError("Trafikverket API key not provided")
+
+    start_time_input = data.get("startTime", "").strip()  # expected "hh:mm"
+    auto_date_input = data.get("date", "").strip()         # expected "YYYY-MM-DD"
+    end_date_input = data.get("endDate", "").strip()       # expected "YYYY-MM-DD"
+
+    if routes is None:
+        routes = [(data.get("from") or "U", data.get("to") or "Cst")]
+    if any(
+        not isinstance(route, (list, tuple))
+        or len(route) != 2
+        or not all(isinstance(s, str) and stations.registry.get(s) for s in route)
+        for route in routes
+    ):
+        raise ValueError("Unknown route")
 
-    start_time_input = request.json.get("startTime", "").strip()  # expected "hh:mm"
-    auto_date_input = request.json.get("date", "").strip()         # expected "YYYY-MM-DD"
-    
     now = datetime.datetime.now(tz)
-    
+
     try:
         # Determine base date.
         if auto_date_input:
             base_date = datetime.datetime.strptime(auto_date_input, "%Y-%m-%d").date()
         else:
             base_date = now.date()
-            
+
         if start_time_input:
             # Use provided start time with the base date.
             user_time = datetime.datetime.strptime(start_time_input, "%H:%M").time()
@@ -168,69 +600,252 @@ def auto_submit():
                 # Otherwise, use the previous 24 hours (ending now).
                 end_time = now
                 start_time = now - datetime.timedelta(hours=24)
-    except Exception as e:
-        return f"Invalid time or date format: {str(e)}", 400
 
-    # Get departures using the Trafikverket API.
-    try:
-        all_departures = get_delayed_or_cancelled("U", "Cst", start_time, end_time, tv_api_key)
+        if end_date_input:
+            # Scan whole days up to and including the end date.
+            end_date = datetime.datetime.strptime(end_date_input, "%Y-%m-%d").date()
+            end_time = tz.localize(datetime.datetime.combine(end_date, datetime.time.max))
+            if end_time < start_time:
+                raise ValueError("end date is before the start of the scan")
     except Exception as e:
-        print(e)
-        return f"Error retrieving departures: {str(e)}", 500
+        raise ValueError(f"Invalid time or date format: {str(e)}")
+
+    if end_time - start_time > datetime.timedelta(days=config.scan_max_days):
+        raise ValueError(f"Scans may cover at most {config.scan_max_days} days")
+
+    return tv_api_key, routes, start_time, end_time
 
-    # Here you can optionally filter departures further based on the time window,
-    # if needed. In this example, we assume get_delayed_or_cancelled() has already done that.
-    filtered = all_departures
 
-    # Build a list of submission items.
+def build_submission_items(departures, customer=None, operator="mt"):
+    """
+    Turns the journeys found by a delay scan that qualify with `operator` into
+    the items shown to the user and sent back to /api/submit_selected. Items
+    that `customer` has already claimed are marked as such.
+    """
     submission_items = []
-    for dep in filtered:
+    for dep in departures:
+        if not dep["tiers"].get(operator):
+            continue
         try:
-            dt = parser.parse(dep["departureTime"])
-            # Format the departure time as "hh:mm dd-mm-yy"
-            formatted_time = dt.strftime("%H:%M %d-%m-%y")
             if dep.get("canceled"):
-                item = {
-                    "ticket": dep.get("ticket"),
-                    "from": dep.get("from"),
-                    "to": dep.get("to"),
-                    "departureDate": dep.get("departureDate"),
-                    "departureTime": dep.get("departureTime"),
-                    "status": "cancelled"
-                }
+                status = "cancelled"
+            elif dep.get("delay") is not None:
+                status = f"delayed {dep['delay']:.0f} min"
             else:
-                item = {
-                    "ticket": dep.get("ticket"),
-                    "from": dep.get("from"),
-                    "to": dep.get("to"),
-                    "departureDate": dep.get("departureDate"),
-                    "departureTime": dep.get("departureTime"),
-                    "status": f"delayed {dep.get('delay'):.0f} min"
-                }
-            submission_items.append(item)
+                # Eligible without a known delay, e.g. a replacement bus
+                status = dep["tiers"][operator]
+            submission_items.append({
+                "ticket": dep.get("ticket"),
+                "from": dep.get("from"),
+                "to": dep.get("to"),
+                "departureDate": dep.get("departureDate"),
+                "departureTime": dep.get("departureTime"),
+                "status": status,
+                "tier": dep["tiers"][operator],
+            })
         except Exception as e:
             print(e)
             continue
 
-    if not submission_items:
-        result = f"No delays or cancellations found between {start_time.strftime('%H:%M %d-%m-%y')} and {end_time.strftime('%H:%M %d-%m-%y')}."
-        return jsonify({"status": "success", "found": 0, "items": [], "message": result})
+    # Mark journeys that have already been claimed so they are not filed again.
+    if not customer:
+        return submission_items
+    already = claim_ledger.filed(operator, submission_items, customer)
+    for item, filed in zip(submission_items, already):
+        if filed:
+            item["status"] = "already submitted"
+            item["alreadySubmitted"] = True
 
-    # Instead of submitting automatically here, we return the list so the user can select.
-    result = (
-        f"{len(submission_items)} delays or cancellations found between "
-        f"{start_time.strftime('%H:%M %d-%m-%y')} and {end_time.strftime('%H:%M %d-%m-%y')}."
-    )
-    return jsonify({"status": "success", "found": len(submission_items), "items": submission_items, "message": result})
+    return submission_items
+
+
+def scan_message(found, start_time, end_time):
+    window = f"between {start_time.strftime('%H:%M %d-%m-%y')} and {end_time.strftime('%H:%M %d-%m-%y')}."
+    if not found:
+        return f"No delays or cancellations found {window}"
+    return f"{found} delays or cancellations found {window}"
+
+
+def find_delayed_or_cancelled(routes, start_time, end_time, tv_api_key):
+    """
+    Answers from the background scan if it covers the window, otherwise gets
+    departures using the Trafikverket API.
+    """
+    if delay_scanner is not None:
+        departures = delay_scanner.lookup(routes, start_time, end_time)
+        if departures is not None:
+            return departures
+
+    return get_delayed_or_cancelled_routes(routes, start_time, end_time, tv_api_key)
 
 
-def get_delayed_or_cancelled(departure_station, arrival_station, start_time, end_time, tv_api_key):
+def iter_delayed_or_cancelled(routes, start_time, end_time, tv_api_key):
     """
-    Uses Trafikverket API to retrieve TrainAnnouncement data for the entire day
-    (from 00:00 to 24:00) for the given departure_station and arrival_station.
-    
-    Returns a list of dictionaries for announcements that were either cancelled
-    or delayed by more than 20 minutes. Each dictionary contains:
+    Yields the delayed or cancelled journeys on `routes` one day of the window
+    at a time, as soon as each day has been synced, so that results can be
+    sent before the whole window has been scanned. Together they are the
+    journeys get_delayed_or_cancelled_routes() returns, each yielded once.
+    """
+    if delay_scanner is not None:
+        departures = delay_scanner.lookup(routes, start_time, end_time)
+        if departures is not None:
+            yield departures
+            return
+
+    # Look past the end of the window so that late trains have arrived.
+    end_time = end_time + journeys.ARRIVAL_MARGIN
+    scan_stations = {station for route in routes for station in route}
+    routes = [tuple(route) for route in routes]
+    seen = set()
+    piece_start = start_time
+    for synced in announcement_store.iter_sync(
+        tv_api_key, scan_stations, start_time, end_time, tz
+    ):
+        # Journeys still on their way at the end of the day are matched with
+        # the next one, which looks back over this day for their departure.
+        anns = announcement_store.query(scan_stations, piece_start, synced)
+        departures = []
+        for dep in delayed_or_cancelled(anns, routes):
+            if synced < end_time and dep["delay"] is None and not dep["canceled"]:
+                # Not arrived yet; the next day has its outcome.
+                continue
+            key = (dep["ticket"], dep["from"], dep["to"], dep["departureDate"], dep["departureTime"])
+            if key not in seen:
+                seen.add(key)
+                departures.append(dep)
+        yield departures
+        piece_start = max(start_time, synced - datetime.timedelta(days=1))
+
+
+def check_profiles_token():
+    """
+    Batch mode stores many commuters' personal details, so it is only
+    available when PROFILES_TOKEN is set, and every request must send it in
+    the X-Profiles-Token header. Returns an error response, or None.
+    """
+    if not config.profiles_token:
+        return jsonify({"status": "error", "message": "Batch mode is not enabled"}), 404
+    if not hmac.compare_digest(
+        request.headers.get("X-Profiles-Token", ""), config.profiles_token
+    ):
+        return jsonify({"status": "error", "message": "Invalid profiles token"}), 403
+    return None
+
+
+@app.route("/api/profiles", methods=["GET"])
+def list_profiles():
+    error = check_profiles_token()
+    if error:
+        return error
+
+    return jsonify({"profiles": profile_store.all()})
+
+
+@app.route("/api/profiles", methods=["POST"])
+def add_profile():
+    error = check_profiles_token()
+    if error:
+        return error
+
+    profile = request.get_json()
+    missing = [
+        k
+        for k in ("name", "operator", "ticket", "from", "to", "validUntil", "customer")
+        if not profile.get(k)
+    ]
+    if missing:
+        return jsonify({"status": "error", "message": f"Missing fields: {', '.join(missing)}"}), 400
+    if profile["operator"] not in operators.OPERATORS:
+        return jsonify({"status": "error", "message": "Unknown operator"}), 400
+    if not (stations.registry.get(profile["from"]) and stations.registry.get(profile["to"])):
+        return jsonify({"status": "error", "message": "Unknown route"}), 400
+    try:
+        datetime.datetime.strptime(profile["validUntil"], "%Y-%m-%d")
+    except ValueError:
+        return jsonify({"status": "error", "message": "validUntil must be YYYY-MM-DD"}), 400
+
+    return jsonify({"status": "success", "id": profile_store.add(profile)}), 201
+
+
+@app.route("/api/profiles/<profile_id>", methods=["DELETE"])
+def remove_profile(profile_id):
+    error = check_profiles_token()
+    if error:
+        return error
+
+    if not profile_store.remove(profile_id):
+        return jsonify({"status": "error", "message": "No such profile"}), 404
+    return jsonify({"status": "success"})
+
+
+@app.route("/api/batch_scan", methods=["POST"])
+def batch_scan():
+    """
+    Scans every route travelled by a registered commuter once and matches the
+    delayed or cancelled journeys with each commuter. With "submit": true the
+    new claims are queued, one job per commuter. Takes the same window fields
+    as /api/auto_submit; the API key defaults to TV_API_KEY.
+    """
+    error = check_profiles_token()
+    if error:
+        return error
+
+    data = {"tv_api_key": config.tv_api_key, **request.json}
+    all_profiles = profile_store.all()
+    routes = profiles.routes(all_profiles)
+    if not routes:
+        return jsonify({"status": "success", "found": 0, "profiles": [], "message": "No profiles registered."})
+
+    try:
+        tv_api_key, routes, start_time, end_time = read_scan_request(data, routes)
+    except ValueError as e:
+        return str(e), 400
+
+    try:
+        departures = find_delayed_or_cancelled(routes, start_time, end_time, tv_api_key)
+    except Exception as e:
+        print(e)
+        return f"Error retrieving departures: {str(e)}", upstream_error_status(e)
+
+    claims = profiles.fan_out(all_profiles, departures)
+    results = []
+    for profile in all_profiles:
+        items = claims[profile["id"]]
+        filed = claim_ledger.filed(profile["operator"], items, profile["customer"])
+        for item, already in zip(items, filed):
+            item["alreadySubmitted"] = already
+
+        job_id = None
+        new_items = [item for item in items if not item["alreadySubmitted"]]
+        if request.json.get("submit") and new_items:
+            job_id = job_queue.enqueue(
+                {
+                    "operator": profile["operator"],
+                    "items": new_items,
+                    "customer": profile["customer"],
+                }
+            )
+
+        results.append({"id": profile["id"], "name": profile["name"], "items": items, "job": job_id})
+
+    return jsonify({
+        "status": "success",
+        "found": len(departures),
+        "profiles": results,
+        "message": scan_message(len(departures), start_time, end_time),
+    })
+
+
+def get_delayed_or_cancelled_routes(routes, start_time, end_time, tv_api_key):
+    """
+    Uses Trafikverket API, through the local announcement store, to retrieve
+    TrainAnnouncement data for the given window for a list of
+    (departure_station, arrival_station) routes. All routes are answered from
+    one set of announcements covering the union of their stations.
+
+    Returns a list of dictionaries for journeys that qualify for compensation
+    with at least one operator under the rules in rules.json. Each dictionary
+    contains:
       - ticket: the train identifier (AdvertisedTrainIdent)
       - from: departure station (from the announcement's FromLocation if available,
               otherwise the provided departure_station)
@@ -241,164 +856,140 @@ def get_delayed_or_cancelled(departure_station, arrival_station, start_time, end
       - canceled: boolean (True if cancelled)
       - delay: delay in minutes (if not cancelled), else None
       - ActivityType: the activity type (e.g., "Avgang" or "Ankomst")
+      - tiers: {operator: compensation tier, or None if not eligible}
     """
 
-    # Add 1 hour to compensate for arrival time, ugly fix
-    end_time = end_time + datetime.timedelta(hours=1)
+    # Look past the end of the window so that late trains have arrived.
+    end_time = end_time + journeys.ARRIVAL_MARGIN
 
-    # Convert start and end times to ISO 8601 format.
-    start_str = start_time.isoformat()
-    end_str = end_time.isoformat()
     if debug_mode:
-        print(f"START: {start_str}, END: {end_str}")
-    
-    # Build the XML query for Trafikverket API, using the provided API key.
-    query = f"""
-        <REQUEST>
-          <LOGIN authenticationkey="{tv_api_key}" />
-          <QUERY objecttype="TrainAnnouncement" schemaversion="1.9" limit="1000">
-            <FILTER>
-              <GT name="AdvertisedTimeAtLocation" value="{start_str}" />
-              <LT name="AdvertisedTimeAtLocation" value="{end_str}" />
-              <EQ name="Operator" value="TDEV" />
-              <OR>
-                <EQ name="LocationSignature" value="{departure_station}" />
-                <EQ name="LocationSignature" value="{arrival_station}" />
-              </OR>
-            </FILTER>
-            <INCLUDE>AdvertisedTrainIdent</INCLUDE>
-            <INCLUDE>AdvertisedTimeAtLocation</INCLUDE>
-            <INCLUDE>TimeAtLocation</INCLUDE>
-            <INCLUDE>LocationSignature</INCLUDE>
-            <INCLUDE>Operator</INCLUDE>
-            <INCLUDE>Canceled</INCLUDE>
-            <INCLUDE>ActivityType</INCLUDE>
-          </QUERY>
-        </REQUEST>
-    """
-    tv_url = "https://api.trafikinfo.trafikverket.se/v2/data.json"
-    headers = {"Content-Type": "text/xml"}
-    response = requests.post(tv_url, data=query.encode("utf-8"), headers=headers)
-    response.raise_for_status()
-    tv_data = response.json()
-    
-    trains = {}
-
-    for result in tv_data.get("RESPONSE", {}).get("RESULT", []):
-        for ann in result.get("TrainAnnouncement", []):
-            train_id = ann.get("AdvertisedTrainIdent", "N/A")
-            loc = ann.get("LocationSignature", None)
-            # Only consider announcements for U or Cst.
-            if loc not in {departure_station, arrival_station}:
-                continue
-            try:
-                adv_time = parser.parse(ann.get("AdvertisedTimeAtLocation"))
-            except Exception:
-                continue
-            trains.setdefault(train_id, []).append({
-                "location": loc,
-                "adv_time": adv_time,
-                "adv_time_str": ann.get("AdvertisedTimeAtLocation"),
-                "time_at_location_str": ann.get("TimeAtLocation"),
-                "canceled": ann.get("Canceled", False),
-                "ActivityType": ann.get("ActivityType")
-            })
+        print(f"START: {start_time.isoformat()}, END: {end_time.isoformat()}")
 
-    delayed_or_cancelled = []
-
-    for train_id, anns in trains.items():
-        # Build lists filtered by station and ActivityType.
-        u_departures = [a for a in anns if a["location"] == departure_station and a.get("ActivityType") == "Avgang"]
-        u_arrivals   = [a for a in anns if a["location"] == departure_station and a.get("ActivityType") == "Ankomst"]
-        cst_departures = [a for a in anns if a["location"] == arrival_station and a.get("ActivityType") == "Avgang"]
-        cst_arrivals   = [a for a in anns if a["location"] == arrival_station and a.get("ActivityType") == "Ankomst"]
-    
-        candidate = None
-        # Option 1: Journey from U to Cst:
-        if u_departures and cst_arrivals:
-            dep_ann = min(u_departures, key=lambda a: a["adv_time"])
-            arr_ann = max(cst_arrivals, key=lambda a: a["adv_time"])
-            if dep_ann["adv_time"] < arr_ann["adv_time"]:
-                candidate = (departure_station, dep_ann, arrival_station, arr_ann)
-        # Option 2: Journey from Cst to U:
-        if candidate is None and cst_departures and u_arrivals:
-            dep_ann = min(cst_departures, key=lambda a: a["adv_time"])
-            arr_ann = max(u_arrivals, key=lambda a: a["adv_time"])
-            if dep_ann["adv_time"] < arr_ann["adv_time"]:
-                candidate = (arrival_station, dep_ann, departure_station, arr_ann)
-        
-        if candidate is None:
-            continue
-    
-        dep_station, dep_ann, arr_station, arr_ann = candidate
-    
-        if arr_ann["canceled"]:
-            status = "canceled"
-            delay = None
-        else:
-            try:
-                adv_arr = parser.parse(arr_ann["adv_time_str"])
-                actual_arr = parser.parse(arr_ann["time_at_location_str"])
-                delay = (actual_arr - adv_arr).total_seconds() / 60
-            except Exception:
-                delay = None
-            status = "delay" if delay is not None and delay > 20 else "ok"
-    
-        if status in {"canceled", "delay"}:
-            date_str = dep_ann["adv_time"].strftime("%Y-%m-%d")
-            time_str = dep_ann["adv_time"].strftime("%H:%M:%S")
-
-            if debug_mode:
-                print(f"DATE: {date_str}, TIME: {time_str}")
-
-            delayed_or_cancelled.append({
-                "ticket": train_id,
-                "from": dep_station,
-                "to": arr_station,
-                "departureDate": date_str,
-                "departureTime": time_str,
-                "canceled": arr_ann["canceled"],
-                "delay": delay,
-                "ActivityType": arr_ann["ActivityType"],
-                "sort_time": dep_ann["adv_time"]  # Add this field for sorting
-            })
+    # Announcements come from the local store, which only asks Trafikverket
+    # for rows that are new or changed since the last sync.
+    scan_stations = {station for route in routes for station in route}
+    with metrics.timed("announcements_fetch"):
+        anns = announcement_store.fetch(tv_api_key, scan_stations, start_time, end_time, tz)
+
+    return delayed_or_cancelled(anns, [tuple(route) for route in routes])
+
+
+def delayed_or_cancelled(anns, routes):
+    """
+    Matches the journeys on `routes` in a set of announcements, keeps them
+    for /api/stats and returns those that qualify for compensation, in the
+    format of get_delayed_or_cancelled_routes().
+    """
+    with metrics.timed("scan_routes"):
+        found = journeys.route_journeys(anns, routes)
+
+    # Keep every journey, on time or not, for /api/stats.
+    with metrics.timed("history_record"):
+        delay_history.record(found)
+
+    with metrics.timed("eligibility"):
+        tiers = eligibility.evaluate(found)
+
+    results = []
+    for i, journey in enumerate(found):
+        journey_tiers = {operator: tiers[operator][i] for operator in tiers}
+        if any(journey_tiers.values()):
+            results.append(journeys.journey_item(journey) | {"tiers": journey_tiers})
+    return results
+
+
+# Scans every route in the background when an API key is configured.
+delay_scanner = None
+if config.tv_api_key:
+    delay_scanner = scheduler.DelayScanner(
+        lambda routes, start_time, end_time: get_delayed_or_cancelled_routes(
+            routes, start_time, end_time, config.tv_api_key
+        ),
+        ROUTES,
+        config.scan_interval,
+        datetime.timedelta(hours=config.scan_window_hours),
+        tz,
+        os.path.join(config.data_dir, "scan.db") if config.shared_cache else None,
+    )
+    delay_scanner.start()
 
-    # Sort the results by departure time in ascending order (least recent first)
-    delayed_or_cancelled.sort(key=lambda x: x["sort_time"])
-    
-    # Remove the sort_time field before returning
-    for item in delayed_or_cancelled:
-        del item["sort_time"]
-        
-    return delayed_or_cancelled
 
 @app.route("/api/arrival_stations/<station>", methods=["GET"])
 def get_arrival_stations(station):
-    arrival_stations = {
-        "U": ["Cst", "Srv", "Kn", "Mr", "Fvk", "Gä"],
-        "Kn": ["U", "Cst", "Mr"],
-        "Mr": ["U", "Cst", "Kn"],
-        "Cst": ["U", "Kn", "Mr"],
-        "Srv": ["U", "Fvk", "Gä"],
+    return {
+        "stations": [
+            {"name": x, "longname": stations.registry.name(x)} for x in ARRIVAL_STATIONS[station]
+        ]
     }
 
-    station_names = {
-        "U": "Uppsala C",
-        "Cst": "Stockholm C",
-        "Srv": "Storvreta",
-        "Fvk": "Furuvik",
-        "Gä": "Gävle",
-        "Kn": "Knivsta",
-        "Mr": "Märsta",
-    }
 
+@app.route("/api/stations", methods=["GET"])
+def search_stations():
     return {
         "stations": [
-            {"name": x, "longname": station_names[x]} for x in arrival_stations[station]
+            {"name": s["signature"], "longname": s["name"]}
+            for s in stations.registry.search(request.args.get("q", ""))
         ]
     }
 
 
+@app.route("/api/stats", methods=["GET"])
+def get_stats():
+    """
+    Delay statistics from the scan history, grouped by train, route, hour or
+    weekday. Defaults to the last 30 days. Eligibility follows the rules of
+    `operator`, "mt" by default.
+    """
+    args = request.args
+    operator = args.get("operator", "mt")
+    if operator not in eligibility.operators:
+        return jsonify({"error": f"Unknown operator {operator}"}), 400
+    try:
+        end = (
+            datetime.datetime.strptime(args["end"], "%Y-%m-%d").date()
+            if args.get("end")
+            else datetime.datetime.now(tz).date()
+        )
+        start = (
+            datetime.datetime.strptime(args["start"], "%Y-%m-%d").date()
+            if args.get("start")
+            else end - datetime.timedelta(days=29)
+        )
+        train = int(args["train"]) if args.get("train") else None
+        with metrics.timed("stats"):
+            results = delay_history.stats(
+                start,
+                end,
+                args.get("group", "train"),
+                eligibility,
+                operator,
+                from_station=args.get("from") or None,
+                to_station=args.get("to") or None,
+                train=train,
+            )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    sort = args.get("sort", "key")
+    if sort in ("meanDelay", "eligibleShare", "journeys"):
+        results.sort(key=lambda r: r[sort] if r[sort] is not None else -1, reverse=True)
+
+    return jsonify(
+        {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "group": args.get("group", "train"),
+            "stats": results,
+        }
+    )
+
+
+# Settle claims interrupted by a restart, then run the jobs queued again.
+# This comes last: jobs may start right away and need the whole module.
+claim_ledger.reconcile(config.claim_pending_timeout)
+job_queue.start()
+
+
 def main():
     app.run(debug=True)
 
@@ -0,0 +1,135 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import config
+import metrics
+from ledger import FAILED, SUBMITTED
+
+
+def submit_items(
+    op,
+    items,
+    customer,
+    workers=None,
+    ledger=None,
+    operator=None,
+    on_result=None,
+    job=None,
+):
+    """
+    Submits every item with `op` using a bounded thread pool and returns one
+    result per item, in the same order as `items`. Each result is a dict with
+    the train ticket, whether the submission succeeded and an error message.
+
+    If a claim ledger is given, items that `customer` already claimed with
+    `operator` are not sent again and are marked with "alreadySubmitted" in
+    their result, and every attempt is recorded in its attempt log. Items
+    still being submitted by another request, or listed twice, fail with an
+    error. `job` identifies the queued job submitting the items; each call is
+    one run of the job, see ClaimLedger.reserve().
+
+    If given, `on_result(index, result)` is called as soon as each item is
+    done, in completion order.
+    """
+    if not items:
+        return []
+
+    results = [None] * len(items)
+    run = uuid.uuid4().hex if job is not None else None
+    workers = min(workers or config.submit_workers, len(items))
+    submit_item = metrics.in_trace(_submit_item)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                submit_item, op, item, customer, ledger, operator, job, run
+            ): i
+            for i, item in enumerate(items)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            if on_result is not None:
+                on_result(i, results[i])
+
+    return results
+
+
+def _submit_item(op, item, customer, ledger, operator, job, run):
+    if ledger is not None and not ledger.reserve(
+        operator, item, customer, job, run
+    ):
+        if ledger.status(operator, item, customer) == SUBMITTED:
+            return {
+                "ticket": item.get("ticket"),
+                "submitted": False,
+                "alreadySubmitted": True,
+                "error": None,
+            }
+        return {
+            "ticket": item.get("ticket"),
+            "submitted": False,
+            "error": f"Train {item.get('ticket')} is already being submitted",
+        }
+
+    result, response, duration = _send_item(op, item, customer)
+
+    if ledger is not None:
+        ledger.record_attempt(
+            operator,
+            item,
+            SUBMITTED if result["submitted"] else FAILED,
+            http_status=getattr(response, "status_code", None),
+            response=getattr(response, "text", None),
+            error=result["error"],
+            duration=duration,
+            customer=customer,
+        )
+        if result["submitted"]:
+            ledger.confirm(operator, item, customer)
+        else:
+            ledger.release(operator, item, customer)
+
+    return result
+
+
+def _send_item(op, item, customer):
+    """
+    Submits one item. Returns the result, the upstream response (None if the
+    request failed before a final response came back) and the time taken.
+    """
+    started = time.monotonic()
+    try:
+        r = op.submit(
+            item.get("ticket"),
+            item.get("from"),
+            item.get("to"),
+            item.get("departureDate"),
+            item.get("departureTime"),
+            customer,
+        )
+    except Exception as e:
+        # HTTP errors raised by a step of the claim still carry its response.
+        return (
+            {"ticket": item.get("ticket"), "submitted": False, "error": str(e)},
+            getattr(e, "response", None),
+            time.monotonic() - started,
+        )
+    duration = time.monotonic() - started
+
+    if r:
+        return (
+            {"ticket": item.get("ticket"), "submitted": True, "error": None},
+            r,
+            duration,
+        )
+
+    return (
+        {
+            "ticket": item.get("ticket"),
+            "submitted": False,
+            "error": f"Submission failed for train {item.get('ticket')}: {getattr(r, 'text', '')}",
+        },
+        r,
+        duration,
+    )
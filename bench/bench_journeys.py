@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Benchmarks the journey matcher and the eligibility rules in rules.json on
+synthetic days of announcements.
+
+    python bench/bench_journeys.py [trains] [routes]
+"""
+
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import journeys  # noqa: E402
+import rules  # noqa: E402
+
+RULES = os.path.join(os.path.dirname(__file__), "..", "rules.json")
+
+STATIONS = ["U", "Kn", "Mr", "Cst", "Srv", "Fvk", "Gä"]
+
+
+def synthetic_day(trains, seed=1, day=datetime.date(2024, 3, 5)):
+    """
+    Returns announcements for `trains` trains running along STATIONS (or in
+    reverse) on `day`, with random delays and the odd cancellation.
+    """
+    rng = random.Random(seed)
+    tz = datetime.timezone(datetime.timedelta(hours=1))
+    start = datetime.datetime.combine(day, datetime.time(5, 0), tzinfo=tz)
+    anns = []
+
+    for i in range(trains):
+        stations = STATIONS if i % 2 else STATIONS[::-1]
+        t = start + datetime.timedelta(minutes=rng.randrange(0, 18 * 60))
+        delay = datetime.timedelta(minutes=rng.choice([0, 0, 0, 3, 10, 25, 45]))
+        canceled = rng.random() < 0.02
+        for n, station in enumerate(stations):
+            for activity in (journeys.ARRIVAL, journeys.DEPARTURE):
+                if (n == 0 and activity == journeys.ARRIVAL) or (
+                    n == len(stations) - 1 and activity == journeys.DEPARTURE
+                ):
+                    continue
+                anns.append(
+                    {
+                        "ActivityId": f"{day}:{i}:{station}:{activity}",
+                        "AdvertisedTrainIdent": str(1000 + i),
+                        "AdvertisedTimeAtLocation": t.isoformat(
+                            timespec="milliseconds"
+                        ),
+                        "TimeAtLocation": None
+                        if canceled
+                        else (t + delay).isoformat(timespec="milliseconds"),
+                        "LocationSignature": station,
+                        "Operator": "TDEV",
+                        "Canceled": canceled,
+                        "ActivityType": activity,
+                    }
+                )
+                t += datetime.timedelta(minutes=2 if activity == journeys.ARRIVAL else 8)
+
+    rng.shuffle(anns)
+    return anns
+
+
+def main():
+    trains = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    routes = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    anns = synthetic_day(trains)
+    pairs = [
+        (a, b) for i, a in enumerate(STATIONS) for b in STATIONS[i + 1 :]
+    ][:routes]
+
+    eligibility = rules.EligibilityRules.load(RULES)
+
+    def eligible(found):
+        tiers = eligibility.evaluate(found)
+        return [
+            journey
+            for i, journey in enumerate(found)
+            if any(tiers[operator][i] for operator in tiers)
+        ]
+
+    found = 0
+    started = time.perf_counter()
+    for a, b in pairs:
+        found += len(eligible(journeys.route_journeys(anns, [(a, b)])))
+    elapsed = time.perf_counter() - started
+
+    print(f"{len(anns)} announcements, {len(pairs)} routes, {found} eligible journeys")
+    print(
+        f"one route at a time: {elapsed * 1000:.1f} ms total, "
+        f"{elapsed / len(pairs) * 1000:.2f} ms per route, "
+        f"{len(anns) * len(pairs) / elapsed:,.0f} announcements/s"
+    )
+
+    started = time.perf_counter()
+    shared = eligible(journeys.route_journeys(anns, pairs))
+    elapsed = time.perf_counter() - started
+    assert len(shared) == found
+
+    print(
+        f"all routes in one scan: {elapsed * 1000:.1f} ms total, "
+        f"{elapsed / len(pairs) * 1000:.2f} ms per route"
+    )
+
+
+if __name__ == "__main__":
+    main()
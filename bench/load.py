@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""
+Drives the app under concurrent load against the local mock upstream and
+reports throughput and latency percentiles per endpoint.
+
+    python bench/load.py [--clients 8] [--requests 200] [--latency 0.05]
+                         [--failure-rate 0] [--scenario departures ...]
+
+Everything runs in this process on localhost, so no network access is needed.
+"""
+
+import argparse
+import datetime
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from mock_upstream import MockUpstream  # noqa: E402
+
+CUSTOMER = {
+    "firstName": "Test",
+    "surName": "Testsson",
+    "city": "Uppsala",
+    "streetNameAndNumber": "Gatan 1",
+    "postalCode": "75000",
+    "identityNumber": "19900101-0000",
+    "mobileNumber": "070-0000000",
+    "email": "test@example.com",
+}
+
+
+def scenario_departures(base, session, n):
+    day = datetime.date(2024, 3, 1) + datetime.timedelta(days=n % 7)
+    r = session.get(f"{base}/api/departures/U/Cst/{day}")
+    r.raise_for_status()
+
+
+def scenario_auto_submit(base, session, n):
+    day = datetime.date(2024, 3, 1) + datetime.timedelta(days=n % 14)
+    r = session.post(
+        f"{base}/api/auto_submit",
+        json={"tv_api_key": "mock", "date": str(day), "routes": "all"},
+    )
+    r.raise_for_status()
+
+
+def scenario_submit_selected(base, session, n):
+    # Unique departures, so the claim ledger does not skip any of them.
+    day = datetime.date(2024, 1, 1) + datetime.timedelta(days=n)
+    items = [
+        {
+            "ticket": str(1000 + i),
+            "from": "U",
+            "to": "Cst",
+            "departureDate": str(day),
+            "departureTime": f"{6 + i:02d}:05:00",
+        }
+        for i in range(5)
+    ]
+    r = session.post(
+        f"{base}/api/submit_selected", json={"items": items, "customer": CUSTOMER}
+    )
+    r.raise_for_status()
+
+    # The submission is queued; wait until the job has finished.
+    job_id = r.json()["job"]
+    while True:
+        job = session.get(f"{base}/api/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(0.02)
+    if job["status"] == "failed" or job["result"]["status"] != "success":
+        raise RuntimeError(job["error"] or job["result"]["message"])
+
+
+SCENARIOS = {
+    "departures": scenario_departures,
+    "auto_submit": scenario_auto_submit,
+    "submit_selected": scenario_submit_selected,
+}
+
+
+def run(base, scenario, clients, total):
+    counter = itertools.count()
+    latencies = []
+    errors = []
+    local = threading.local()
+
+    def one(_):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            scenario(base, local.session, next(counter))
+        except Exception as e:
+            errors.append(e)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+
+    return elapsed, sorted(latencies), errors
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0)
+    parser.add_argument(
+        "--scenario", action="append", choices=sorted(SCENARIOS), dest="scenarios"
+    )
+    args = parser.parse_args()
+
+    mock = MockUpstream(latency=args.latency, failure_rate=args.failure_rate).start()
+
+    # The app reads its settings at import time.
+    os.environ.update(mock.env())
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="mt-payback-bench-")
+    os.environ.setdefault("HOST_RATE_LIMIT", "0")
+    os.environ.pop("TV_API_KEY", None)
+
+    from werkzeug.serving import make_server
+
+    import app
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    server = make_server("127.0.0.1", 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    print(
+        f"{args.clients} clients, {args.requests} requests per scenario, "
+        f"upstream latency {args.latency * 1000:.0f} ms, "
+        f"failure rate {args.failure_rate:.0%}"
+    )
+    print(f"{'scenario':<16} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name in args.scenarios or list(SCENARIOS):
+        elapsed, latencies, errors = run(base, SCENARIOS[name], args.clients, args.requests)
+        print(
+            f"{name:<16} {len(latencies) / elapsed:>8.1f} "
+            f"{percentile(latencies, 0.5) * 1000:>8.1f} "
+            f"{percentile(latencies, 0.99) * 1000:>8.1f} {len(errors):>7}"
+        )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+"""
+A local stand-in for the Mälartåg, SJ and Trafikverket APIs.
+
+    python bench/mock_upstream.py [--port 8900] [--latency 0.05] [--failure-rate 0]
+
+Point the app at it with
+
+    MT_API_URL=http://localhost:8900/mt SJ_API_URL=http://localhost:8900/sj \\
+    TV_API_URL=http://localhost:8900/tv/data.json STATION_SIGNATURE_FIELD=signature \\
+    python app.py
+
+Every request waits `latency` seconds and fails with 503 at `failure_rate`.
+Trafikverket queries are answered with synthetic announcements for the days
+in the requested window.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bench_journeys  # noqa: E402
+import journeys  # noqa: E402
+
+# Field of the mock TrainStations entries holding the Trafikverket signature,
+# passed to the app in STATION_SIGNATURE_FIELD.
+SIGNATURE_FIELD = "signature"
+
+# Stations listed by TrainStations, by Trafikverket signature.
+STATIONS = {
+    "U": "Uppsala C",
+    "Cst": "Stockholm C",
+    "Srv": "Storvreta",
+    "Fvk": "Furuvik",
+    "Gä": "Gävle",
+    "Kn": "Knivsta",
+    "Mr": "Märsta",
+    "Arnc": "Arlanda C",
+    "Hgl": "Heby",
+    "Sa": "Sala",
+    "Vå": "Västerås C",
+}
+
+
+class MockUpstream(ThreadingHTTPServer):
+    daemon_threads = True
+    # Windows are synced in parallel, so many connections arrive at once.
+    request_queue_size = 128
+
+    def __init__(self, port=0, latency=0.05, failure_rate=0, trains=300):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.trains = trains
+        self.days = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def env(self):
+        """Environment variables that point the app at this server."""
+        return {
+            "MT_API_URL": f"{self.url}/mt",
+            "SJ_API_URL": f"{self.url}/sj",
+            "TV_API_URL": f"{self.url}/tv/data.json",
+            "STATION_SIGNATURE_FIELD": SIGNATURE_FIELD,
+        }
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def announcements(self, day):
+        with self.lock:
+            if day not in self.days:
+                self.days[day] = bench_journeys.synthetic_day(
+                    self.trains, seed=day.toordinal(), day=day
+                )
+            return self.days[day]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_PUT(self):
+        self._handle()
+
+    def _handle(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(self.server.latency)
+        if random.random() < self.server.failure_rate:
+            return self._send(503, {"error": "mock failure"})
+
+        path = self.path.split("?")[0]
+        if path.rstrip("/") == "/mt/TrainStations":
+            return self._send(200, {"data": self._train_stations()})
+        if path.startswith("/mt/TrainStations/GetDepartureTimeList"):
+            departures = [
+                f"2024-03-05T{h:02d}:{m:02d}" for h in range(5, 23) for m in (5, 35)
+            ]
+            return self._send(200, {"data": departures})
+        if path.startswith("/mt/TrainStations/GetDistance"):
+            return self._send(200, {"data": {"trafikverketTrainId": "1000"}})
+        if path.startswith("/mt/Claims"):
+            return self._send(200, {"id": str(uuid.uuid4())})
+        if path.startswith("/sj/bankaccountrecords"):
+            return self._send(200, {"barId": str(uuid.uuid4())})
+        if path.startswith("/sj/") and path.endswith("/confirmations"):
+            return self._send(200, {"status": "confirmed"})
+        if path.startswith("/sj/"):
+            return self._send(200, {"delayCompensationToken": uuid.uuid4().hex})
+        if path.startswith("/tv/"):
+            return self._send(200, self._train_announcements(body.decode("utf-8")))
+
+        self._send(404, {"error": "not found"})
+
+    def _train_stations(self):
+        return [
+            {
+                "id": str(uuid.uuid5(uuid.NAMESPACE_URL, signature)),
+                "name": name,
+                SIGNATURE_FIELD: signature,
+            }
+            for signature, name in STATIONS.items()
+        ]
+
+    def _train_announcements(self, query):
+        def value(op):
+            m = re.search(rf'<{op} name="AdvertisedTimeAtLocation" value="([^"]+)"', query)
+            return journeys.parse_time(m.group(1)) if m else None
+
+        start = value("GTE") or value("GT")
+        end = value("LT")
+        limit = int(re.search(r'limit="(\d+)"', query).group(1))
+        skip = re.search(r'skip="(\d+)"', query)
+        skip = int(skip.group(1)) if skip else 0
+        stations = set(re.findall(r'<EQ name="LocationSignature" value="([^"]+)"', query))
+        change_id = re.search(r'changeid="([^"]*)"', query)
+
+        anns = []
+        # Rows never change here, so incremental queries return nothing new.
+        if change_id is None or change_id.group(1) == "0":
+            day = start.date() - datetime.timedelta(days=1)
+            while day <= end.date():
+                for ann in self.server.announcements(day):
+                    t = journeys.parse_time(ann["AdvertisedTimeAtLocation"])
+                    if ann["LocationSignature"] in stations and start <= t < end:
+                        anns.append(ann)
+                day += datetime.timedelta(days=1)
+        anns.sort(key=lambda ann: (ann["AdvertisedTimeAtLocation"], ann["ActivityId"]))
+
+        return {
+            "RESPONSE": {
+                "RESULT": [
+                    {"TrainAnnouncement": anns[skip : skip + limit], "INFO": {"LASTCHANGEID": "1"}}
+                ]
+            }
+        }
+
+    def _send(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    server = MockUpstream(args.port, args.latency, args.failure_rate)
+    print(f"Mock upstream listening on {server.url}")
+    for name, value in server.env().items():
+        print(f"  {name}={value}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Measures how long a fresh interpreter takes to import the app, the cost paid
+by every new gunicorn worker, and lists the slowest imports.
+
+    python bench/startup.py [--runs 5] [--top 15]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def import_app(data_dir, importtime=False):
+    """Imports the app in a new interpreter and returns (seconds, stderr)."""
+    env = {**os.environ, "DATA_DIR": data_dir, "TV_API_KEY": ""}
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", "import app"]
+
+    started = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if proc.returncode != 0:
+        sys.exit(proc.stderr)
+    return elapsed, proc.stderr
+
+
+def slowest_imports(stderr, top):
+    """
+    Parses `python -X importtime` output and returns the total time of
+    `import app` and its `top` slowest direct imports, in microseconds, as
+    (total, [(microseconds, module)]).
+    """
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Nested imports are indented by two spaces per level and printed
+        # before the module that imports them.
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((int(cumulative), name.strip()))
+        elif depth == 0:
+            if name.strip() == "app":
+                return int(cumulative), sorted(children, reverse=True)[:top]
+            children = []
+    return 0, []
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=15)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        # The first import creates the SQLite files and warms the bytecode cache.
+        import_app(data_dir)
+        times = [import_app(data_dir)[0] for _ in range(args.runs)]
+        _, stderr = import_app(data_dir, importtime=True)
+
+    print(
+        f"import app: median {statistics.median(times) * 1000:.0f} ms,"
+        f" min {min(times) * 1000:.0f} ms over {args.runs} runs"
+        " (including interpreter start)"
+    )
+    total, imports = slowest_imports(stderr, args.top)
+    print("\nimport time of app and its slowest direct imports:")
+    print(f"{total / 1000:8.1f}  app")
+    for cumulative, name in imports:
+        print(f"{cumulative / 1000:8.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+_missing = object()
+
+# Seconds between deletions of expired and surplus rows from the SQLite file.
+PRUNE_INTERVAL = 60
+
+
+hits = metrics.counter("cache_hits_total", "Cache lookups that found a value.")
+misses = metrics.counter("cache_misses_total", "Cache lookups that found nothing.")
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """
+    A thread-safe in-memory cache with per-entry expiry and least recently
+    used eviction once `maxsize` entries are stored.
+
+    If `path` is given, entries are also written to an SQLite file so they
+    survive restarts and are shared with other processes using the same
+    file, which find them there on a miss. Keys and values must be JSON
+    serializable. Writes delete expired rows from the file, and the rows
+    written longest ago beyond `maxsize`, at most every PRUNE_INTERVAL
+    seconds.
+    """
+
+    def __init__(self, maxsize, ttl, path=None, table="cache", name=None):
+        self.name = name or table
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.table = table
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+        self.inflight = {}
+        self.db = None
+        self.pruned = 0
+
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                "(key TEXT PRIMARY KEY, value TEXT, expires REAL)"
+            )
+            self.db.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_expires ON {table} (expires)"
+            )
+            self.db.commit()
+
+    def get(self, key, default=None):
+        value = self._lookup(key, _missing)
+        if value is _missing:
+            misses.inc(cache=self.name)
+            return default
+
+        hits.inc(cache=self.name)
+        return value
+
+    def _lookup(self, key, default):
+        now = time.time()
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > now:
+                    self.data.move_to_end(key)
+                    return value
+                del self.data[key]
+
+            if self.db is None:
+                return default
+
+            row = self.db.execute(
+                f"SELECT value, expires FROM {self.table} WHERE key = ?",
+                (json.dumps(key),),
+            ).fetchone()
+            if row is None or row[1] <= now:
+                return default
+
+            value = json.loads(row[0])
+            self._store(key, value, row[1])
+            return value
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl
+        with self.lock:
+            self._store(key, value, expires)
+            if self.db is not None:
+                self.db.execute(
+                    f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)",
+                    (json.dumps(key), json.dumps(value), expires),
+                )
+                if time.time() - self.pruned > PRUNE_INTERVAL:
+                    self._prune()
+                self.db.commit()
+
+    def get_or_set(self, key, func):
+        """
+        Returns the cached value for `key`, calling `func()` to fill it on a
+        miss. Concurrent misses for the same key share a single call to
+        `func()`; if it raises, every waiting caller gets the exception.
+        """
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+
+        with self.lock:
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = _Flight()
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = func()
+            self.set(key, flight.value)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            flight.event.set()
+
+        return flight.value
+
+    def __contains__(self, key):
+        return self._lookup(key, _missing) is not _missing
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            if self.db is not None:
+                self.db.execute(f"DELETE FROM {self.table}")
+                self.db.commit()
+
+    def _prune(self):
+        # Every entry lives for the same ttl, so the earliest expiry was
+        # written longest ago.
+        self.pruned = time.time()
+        self.db.execute(f"DELETE FROM {self.table} WHERE expires < ?", (self.pruned,))
+        self.db.execute(
+            f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table}"
+            " ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+            (self.maxsize,),
+        )
+
+    def _store(self, key, value, expires):
+        self.data[key] = (value, expires)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
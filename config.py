@@ -0,0 +1,118 @@
+import os
+
+# Settings are read from the environment so the same image can be tuned per
+# deployment without code changes.
+
+# Maximum number of claims submitted in parallel by /api/submit_selected.
+submit_workers = int(os.environ.get("SUBMIT_WORKERS", "8"))
+
+# Maximum number of requests per second sent to a single upstream host, and
+# the burst allowed above it. The rate backs off towards HOST_MIN_RATE while
+# the host answers 429 or 5xx. 0 disables the limit.
+host_rate_limit = float(os.environ.get("HOST_RATE_LIMIT", "5"))
+host_rate_burst = int(os.environ.get("HOST_RATE_BURST", "5"))
+host_min_rate = float(os.environ.get("HOST_MIN_RATE", "0.2"))
+
+# Each process limits its own requests, so processes running side by side
+# (the gunicorn workers, set by gunicorn.conf.py) split the limits above
+# between them.
+host_rate_processes = max(int(os.environ.get("HOST_RATE_PROCESSES", "1")), 1)
+
+# After CIRCUIT_FAILURES failed requests in a row a host is considered down
+# and requests to it fail at once for CIRCUIT_COOLDOWN seconds.
+circuit_failures = int(os.environ.get("CIRCUIT_FAILURES", "5"))
+circuit_cooldown = float(os.environ.get("CIRCUIT_COOLDOWN", "30"))
+
+# Connection pooling and timeouts for outbound HTTP calls.
+http_pool_connections = int(os.environ.get("HTTP_POOL_CONNECTIONS", "10"))
+http_pool_size = int(os.environ.get("HTTP_POOL_SIZE", "20"))
+http_connect_timeout = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+http_read_timeout = float(os.environ.get("HTTP_READ_TIMEOUT", "30"))
+
+# Retries with exponential backoff for failed connections and idempotent
+# requests that get a 502/503/504 back. Retries of error responses go through
+# the rate limit and circuit breaker like any other request.
+http_retries = int(os.environ.get("HTTP_RETRIES", "3"))
+http_backoff = float(os.environ.get("HTTP_BACKOFF", "0.5"))
+
+# Directory for the local SQLite files.
+data_dir = os.environ.get("DATA_DIR", "data")
+
+# Cache for MT train numbers. The mapping from departure to train number does
+# not change, so entries can live for a long time. Set
+# TRAIN_NUMBER_CACHE_PERSIST=0 to keep the cache in memory only.
+train_number_cache_size = int(os.environ.get("TRAIN_NUMBER_CACHE_SIZE", "10000"))
+train_number_cache_ttl = int(os.environ.get("TRAIN_NUMBER_CACHE_TTL", str(30 * 86400)))
+train_number_cache_persist = os.environ.get("TRAIN_NUMBER_CACHE_PERSIST", "1") == "1"
+
+# Keep the departure lists and the background scan results in SQLite files in
+# DATA_DIR as well as in memory, so that all worker processes on the host
+# share them. Set by gunicorn.conf.py.
+shared_cache = os.environ.get("SHARED_CACHE", "0") == "1"
+
+# Cache for the departure lists shown in the form.
+departures_cache_size = int(os.environ.get("DEPARTURES_CACHE_SIZE", "1000"))
+departures_cache_ttl = int(os.environ.get("DEPARTURES_CACHE_TTL", "600"))
+
+# Rows per Trafikverket query; windows that hit the limit are split in two.
+tv_query_limit = int(os.environ.get("TV_QUERY_LIMIT", "1000"))
+
+# Number of days fetched from Trafikverket in parallel for multi-day scans.
+tv_fetch_workers = int(os.environ.get("TV_FETCH_WORKERS", "4"))
+
+# Longest window, in days, a scan request may cover with endDate.
+scan_max_days = int(os.environ.get("SCAN_MAX_DAYS", "31"))
+
+# Background delay scanning. When a Trafikverket API key is configured the
+# app scans every route every SCAN_INTERVAL seconds over the last
+# SCAN_WINDOW_HOURS hours, and /api/auto_submit answers from the latest scan
+# when it covers the requested window.
+tv_api_key = os.environ.get("TV_API_KEY", "")
+scan_interval = int(os.environ.get("SCAN_INTERVAL", "300"))
+scan_window_hours = int(os.environ.get("SCAN_WINDOW_HOURS", "48"))
+
+# Number of threads processing queued claim submissions.
+job_workers = int(os.environ.get("JOB_WORKERS", "2"))
+
+# Claims still pending after this many seconds were interrupted, e.g. by a
+# restart, and are settled from the attempt log on start and by
+# /api/claims/reconcile.
+claim_pending_timeout = int(os.environ.get("CLAIM_PENDING_TIMEOUT", "600"))
+
+# Enables the claim ledger export and reconciliation endpoints, which must
+# send it in the X-Admin-Token header.
+admin_token = os.environ.get("ADMIN_TOKEN", "")
+
+# Print the upstream calls and their timings for every request.
+trace_requests = os.environ.get("TRACE_REQUESTS", "0") == "1"
+
+# Upstream API base URLs. Only changed to point the app at a local stand-in,
+# see bench/mock_upstream.py.
+mt_api_url = os.environ.get(
+    "MT_API_URL", "https://evf-regionsormland.preciocloudapp.net/api"
+)
+sj_api_url = os.environ.get(
+    "SJ_API_URL",
+    "https://prod-api.adp.sj.se/public/delay-compensation/v1/compensation",
+)
+tv_api_url = os.environ.get(
+    "TV_API_URL", "https://api.trafikinfo.trafikverket.se/v2/data.json"
+)
+
+# JSON file with the compensation rules per operator, see rules.py.
+rules_file = os.environ.get(
+    "RULES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json")
+)
+
+# How long, in seconds, the downloaded station list is kept on disk.
+station_cache_ttl = int(os.environ.get("STATION_CACHE_TTL", str(7 * 86400)))
+
+# Field of the upstream TrainStations list that holds each station's
+# Trafikverket location signature. The list is only downloaded when this is
+# set, otherwise the built-in stations are all there is.
+station_signature_field = os.environ.get("STATION_SIGNATURE_FIELD", "")
+
+# Batch mode for many registered commuters is enabled by setting a token that
+# requests to /api/profiles and /api/batch_scan must send in the
+# X-Profiles-Token header.
+profiles_token = os.environ.get("PROFILES_TOKEN", "")
@@ -0,0 +1,39 @@
+# Production settings for gunicorn, used by the Dockerfile:
+#
+#     gunicorn -c gunicorn.conf.py app:app
+#
+# Every setting can be changed with the environment variables below.
+
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:3000")
+
+# gthread runs each request in a thread of a worker process, which suits the
+# app: most of the time is spent waiting on upstream APIs. gevent does the
+# same with greenlets, but needs `pip install gevent`.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("GUNICORN_WORKERS", str(multiprocessing.cpu_count())))
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+# Streaming scans can take a while; gthread and gevent workers keep
+# answering heartbeats meanwhile, so this only catches stuck workers.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+
+# The app starts its background threads (job workers, delay scanner) when it
+# is imported, and threads do not survive fork(), so each worker must import
+# it itself.
+preload_app = False
+
+# Access log file, "-" for stdout; empty to turn it off.
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-") or None
+
+# Workers share the departure cache and the background scan results through
+# SQLite files in DATA_DIR, so they are filled once per host.
+os.environ.setdefault("SHARED_CACHE", "1")
+
+# Upstream rate limits are kept per process, so the workers share them out.
+os.environ.setdefault("HOST_RATE_PROCESSES", str(workers))
@@ -0,0 +1,52 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process is assumed
+    fcntl = None
+
+
+class HostLock:
+    """
+    An exclusive lock shared by all processes on the host, e.g. the workers
+    of one gunicorn instance, based on flock() on a file under DATA_DIR.
+    Also excludes other threads of the same process. Where flock() is not
+    available only the thread lock is taken.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.fd = None
+
+    def acquire(self, blocking=True):
+        if not self.lock.acquire(blocking):
+            return False
+        if fcntl is None:
+            return True
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            self.lock.release()
+            return False
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is not None:
+            # Closing the file drops the flock.
+            os.close(self.fd)
+            self.fd = None
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,171 @@
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import config
+import metrics
+import ratelimit
+
+limiter = ratelimit.RateLimiter(
+    config.host_rate_limit / config.host_rate_processes,
+    burst=config.host_rate_burst // config.host_rate_processes,
+    min_rate=config.host_min_rate / config.host_rate_processes,
+    failure_threshold=config.circuit_failures,
+    cooldown=config.circuit_cooldown,
+)
+
+request_seconds = metrics.histogram(
+    "upstream_request_duration_seconds", "Latency of upstream HTTP requests."
+)
+request_errors = metrics.counter(
+    "upstream_request_errors_total",
+    "Upstream HTTP requests that failed or returned an error status.",
+)
+host_rate = metrics.gauge(
+    "upstream_rate_limit", "Current request rate allowed per upstream host."
+)
+host_circuit_open = metrics.gauge(
+    "upstream_circuit_open", "1 while requests to the upstream host fail fast."
+)
+response_bytes = metrics.histogram(
+    "upstream_response_bytes", "Size of upstream response bodies.", metrics.SIZE_BUCKETS
+)
+
+
+# Error responses after which idempotent requests are sent again.
+RETRY_STATUSES = (502, 503, 504)
+RETRY_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class Session(requests.Session):
+    """
+    A requests session that applies the default timeout, the per-host rate
+    limit and circuit breaker to every request.
+
+    Idempotent requests answered with a 502, 503 or 504 are retried here
+    with exponential backoff rather than in urllib3, so that every retry
+    waits for the rate limit and counts towards the circuit breaker. Only
+    idempotent requests are retried, so a claim is never filed twice
+    because a POST was replayed.
+    """
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault(
+            "timeout", (config.http_connect_timeout, config.http_read_timeout)
+        )
+        retries = config.http_retries if method.upper() in RETRY_METHODS else 0
+        r = self._send(method, url, **kwargs)
+        for attempt in range(retries):
+            if r.status_code not in RETRY_STATUSES:
+                break
+            time.sleep(config.http_backoff * 2**attempt)
+            try:
+                retry = self._send(method, url, **kwargs)
+            except ratelimit.CircuitOpenError:
+                # The host is down; the last error response is the answer.
+                break
+            r.close()
+            r = retry
+        return r
+
+    def _send(self, method, url, **kwargs):
+        host, endpoint = endpoint_name(url)
+        try:
+            limiter.wait(url)
+        except ratelimit.CircuitOpenError:
+            request_errors.inc(host=host, endpoint=endpoint, reason="circuit_open")
+            raise
+
+        started = time.perf_counter()
+        try:
+            r = super().request(method, url, **kwargs)
+        except Exception as e:
+            limiter.record(url)
+            _update_host_metrics(host)
+            request_errors.inc(host=host, endpoint=endpoint, reason=type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            request_seconds.observe(elapsed, host=host, endpoint=endpoint)
+            metrics.record(endpoint, elapsed)
+
+        limiter.record(url, r.status_code, _retry_after(r))
+        _update_host_metrics(host)
+        if r.status_code >= 400:
+            request_errors.inc(host=host, endpoint=endpoint, reason=str(r.status_code))
+        response_bytes.observe(len(r.content), host=host, endpoint=endpoint)
+
+        return r
+
+
+def _update_host_metrics(host):
+    state = limiter.state().get(host)
+    if state:
+        host_rate.set(state["rate"], host=host)
+        host_circuit_open.set(int(state["circuit"] != ratelimit.CLOSED), host=host)
+
+
+def _retry_after(r):
+    try:
+        return float(r.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+
+def endpoint_name(url):
+    """
+    Returns the host and the last path segment of a URL, e.g. "GetDistance" or
+    "confirmations", which names the upstream call in metrics.
+    """
+    parts = urlsplit(url)
+    return parts.hostname, parts.path.rstrip("/").rsplit("/", 1)[-1]
+
+
+def _build_adapter():
+    # Failed connections are retried by urllib3: nothing reached the host, so
+    # even a POST is safe to send again. Error responses are retried by
+    # Session.request(), through the rate limiter.
+    retry = Retry(
+        total=config.http_retries,
+        connect=config.http_retries,
+        read=0,
+        status=0,
+        backoff_factor=config.http_backoff,
+    )
+    return HTTPAdapter(
+        pool_connections=config.http_pool_connections,
+        pool_maxsize=config.http_pool_size,
+        max_retries=retry,
+    )
+
+
+# The adapters own the connection pools, so every session mounting them
+# reuses the same keep-alive connections.
+adapter = _build_adapter()
+
+
+def new_session(headers=None):
+    """
+    Returns a session with its own headers and cookies that shares the
+    process-wide connection pools.
+    """
+    s = Session()
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    if headers:
+        s.headers.update(headers)
+    return s
+
+
+session = new_session()
+
+
+def get(url, **kwargs):
+    return session.get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return session.post(url, **kwargs)
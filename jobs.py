@@ -0,0 +1,219 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """
+    A persistent job queue backed by SQLite and processed by worker threads.
+
+    `handler(payload, progress, job_id)` is called for each job and its
+    return value is stored as the job result; if it raises, the job is marked
+    as failed. While the job runs, the handler can call `progress(partial)` to
+    store a partial result that get() returns until the job is done.
+
+    Several processes can share the queue file. A running job records the
+    process that claimed it, which updates the job's heartbeat every
+    `heartbeat_interval` seconds. Jobs whose heartbeat is older than
+    `stale_after` seconds, because their process stopped, are queued again,
+    so accepted work is not lost and running jobs are not started twice.
+
+    The payload, which can hold a customer's personal details, is only kept
+    until the job is done or has failed.
+    """
+
+    def __init__(
+        self,
+        path,
+        handler,
+        workers=2,
+        poll_interval=1,
+        heartbeat_interval=10,
+        stale_after=60,
+    ):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        # Unique per process start, so a restarted process with a reused pid
+        # does not pass for the old one.
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.wakeup = threading.Condition()
+        self.threads = []
+
+        with self._connect() as db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT,
+                    payload TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created REAL,
+                    updated REAL,
+                    owner TEXT,
+                    heartbeat REAL
+                )
+                """
+            )
+            # Queues created before jobs had an owner.
+            columns = [row[1] for row in db.execute("PRAGMA table_info(jobs)")]
+            for column, kind in (("owner", "TEXT"), ("heartbeat", "REAL")):
+                if column not in columns:
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+            # Queues that kept the payloads of finished jobs.
+            db.execute(
+                "UPDATE jobs SET payload = NULL"
+                " WHERE status IN (?, ?) AND payload IS NOT NULL",
+                (DONE, FAILED),
+            )
+
+    def start(self):
+        if self.threads:
+            return
+
+        self._requeue_stale()
+
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{n}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def enqueue(self, payload):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, payload, created, updated)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(payload), now, now),
+            )
+
+        with self.wakeup:
+            self.wakeup.notify()
+
+        return job_id
+
+    def get(self, job_id):
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT id, status, result, error, created, updated FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return {
+            "id": row[0],
+            "status": row[1],
+            "result": json.loads(row[2]) if row[2] else None,
+            "error": row[3],
+            "created": row[4],
+            "updated": row[5],
+        }
+
+    def _progress(self, job_id, partial):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET result = ?, updated = ?"
+                " WHERE id = ? AND status = ? AND owner = ?",
+                (json.dumps(partial), time.time(), job_id, RUNNING, self.owner),
+            )
+
+    def _requeue_stale(self):
+        """Queues again the running jobs whose process has stopped."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, updated = ?"
+                " WHERE status = ? AND (heartbeat IS NULL OR heartbeat < ?)",
+                (QUEUED, now, RUNNING, now - self.stale_after),
+            )
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            try:
+                with self._connect() as db:
+                    db.execute(
+                        "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status = ?",
+                        (time.time(), self.owner, RUNNING),
+                    )
+                # Also picks up the jobs of a process that stopped while the
+                # others kept running.
+                self._requeue_stale()
+            except sqlite3.Error:
+                traceback.print_exc()
+            with self.wakeup:
+                self.wakeup.notify_all()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def _claim(self, db):
+        # The status check in the UPDATE makes claiming safe across worker
+        # threads and processes sharing the same file.
+        while True:
+            row = db.execute(
+                "SELECT id, payload FROM jobs WHERE status = ? ORDER BY created LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            if row is None:
+                return None
+
+            now = time.time()
+            claimed = db.execute(
+                "UPDATE jobs SET status = ?, owner = ?, heartbeat = ?, updated = ?"
+                " WHERE id = ? AND status = ?",
+                (RUNNING, self.owner, now, now, row[0], QUEUED),
+            ).rowcount
+            if claimed:
+                return row[0], json.loads(row[1])
+
+    def _run(self):
+        db = self._connect()
+        while True:
+            job = self._claim(db)
+            if job is None:
+                with self.wakeup:
+                    self.wakeup.wait(self.poll_interval)
+                continue
+
+            job_id, payload = job
+            try:
+                result = self.handler(
+                    payload, lambda partial: self._progress(job_id, partial), job_id
+                )
+                db.execute(
+                    "UPDATE jobs SET status = ?, result = ?, payload = NULL, updated = ?"
+                    " WHERE id = ? AND owner = ?",
+                    (DONE, json.dumps(result), time.time(), job_id, self.owner),
+                )
+            except Exception as e:
+                traceback.print_exc()
+                db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, payload = NULL, updated = ?"
+                    " WHERE id = ? AND owner = ?",
+                    (FAILED, str(e), time.time(), job_id, self.owner),
+                )
@@ -0,0 +1,176 @@
+import datetime
+
+DEPARTURE = "Avgang"
+ARRIVAL = "Ankomst"
+
+# Scans fetch announcements this long past the end of their window, so that
+# trains departing shortly before the end have arrived within it.
+ARRIVAL_MARGIN = datetime.timedelta(hours=1)
+
+
+def parse_time(s):
+    """
+    Parses the ISO 8601 timestamps used by Trafikverket, e.g.
+    "2024-03-05T06:00:00.000+01:00". Falls back to dateutil for anything the
+    fixed-format parser does not understand. Returns None for empty input.
+    """
+    if not s:
+        return None
+    if s.endswith("Z"):
+        s = s[:-1] + "+00:00"
+    try:
+        return datetime.datetime.fromisoformat(s)
+    except ValueError:
+        from dateutil import parser
+
+        return parser.parse(s)
+
+
+def bucket_announcements(anns, stations):
+    """
+    Groups the announcements at `stations` by train in a single pass.
+
+    Returns {train: {(station, activity): [announcement, ...]}}, where each
+    list is sorted by advertised time and each announcement dict has the
+    parsed advertised time added in "adv_time". A train ident is reused every
+    day, so a window longer than a day holds several runs of it.
+    """
+    trains = {}
+
+    for ann in anns:
+        loc = ann.get("LocationSignature")
+        if loc not in stations:
+            continue
+        activity = ann.get("ActivityType")
+        if activity != DEPARTURE and activity != ARRIVAL:
+            continue
+        try:
+            adv_time = parse_time(ann.get("AdvertisedTimeAtLocation"))
+        except Exception:
+            continue
+        if adv_time is None:
+            continue
+
+        bucket = trains.setdefault(ann.get("AdvertisedTrainIdent", "N/A"), {})
+        bucket.setdefault((loc, activity), []).append({"adv_time": adv_time, **ann})
+
+    for bucket in trains.values():
+        for announcements in bucket.values():
+            announcements.sort(key=lambda ann: ann["adv_time"])
+
+    return trains
+
+
+def _runs(deps, arrs):
+    """
+    Pairs each departure with the latest arrival after it and before the
+    next departure from the same station, i.e. within the same run of the
+    train. Both lists are sorted by advertised time.
+    """
+    pairs = []
+    j = 0
+    for i, dep in enumerate(deps):
+        next_dep = deps[i + 1]["adv_time"] if i + 1 < len(deps) else None
+        while j < len(arrs) and arrs[j]["adv_time"] <= dep["adv_time"]:
+            j += 1
+        arr = None
+        while j < len(arrs) and (next_dep is None or arrs[j]["adv_time"] < next_dep):
+            arr = arrs[j]
+            j += 1
+        if arr is not None:
+            pairs.append((dep, arr))
+    return pairs
+
+
+def match_journeys(trains, station_a, station_b):
+    """
+    Finds each train's journeys between two stations in bucketed announcements.
+
+    Every departure from one station is matched with the arrival at the other
+    in the same run, preferring station_a -> station_b: a train with journeys
+    in that direction is not matched the other way.
+
+    Returns a list of (train, from_station, departure, to_station, arrival)
+    tuples.
+    """
+    journeys = []
+    for train, bucket in trains.items():
+        for from_station, to_station in ((station_a, station_b), (station_b, station_a)):
+            runs = _runs(
+                bucket.get((from_station, DEPARTURE), []),
+                bucket.get((to_station, ARRIVAL), []),
+            )
+            if runs:
+                journeys.extend(
+                    (train, from_station, dep, to_station, arr) for dep, arr in runs
+                )
+                break
+
+    return journeys
+
+
+def arrival_delay(arr):
+    """
+    Returns the arrival delay in minutes, or None if the train has not been
+    reported at the station.
+    """
+    try:
+        actual = parse_time(arr.get("TimeAtLocation"))
+    except Exception:
+        return None
+    if actual is None:
+        return None
+    return (actual - arr["adv_time"]).total_seconds() / 60
+
+
+def route_journeys(anns, routes):
+    """
+    Match every journey on the given (station_a, station_b) routes, on time or
+    not. The announcements are bucketed once for the union of all stations
+    and shared by every route. Each journey carries its arrival delay in
+    minutes (None if canceled or not yet arrived) and the deviation texts of
+    its departure and arrival, e.g. "Buss ersätter", sorted by departure.
+    """
+    stations = {station for route in routes for station in route}
+    trains = bucket_announcements(anns, stations)
+    results = []
+
+    for station_a, station_b in routes:
+        for train, from_station, dep, to_station, arr in match_journeys(
+            trains, station_a, station_b
+        ):
+            canceled = bool(arr.get("Canceled", False))
+            results.append(
+                {
+                    "ticket": train,
+                    "from": from_station,
+                    "to": to_station,
+                    "departure": dep["adv_time"],
+                    "canceled": canceled,
+                    "delay": None if canceled else arrival_delay(arr),
+                    "ActivityType": arr.get("ActivityType"),
+                    "deviations": [
+                        d.get("Description", "")
+                        for ann in (dep, arr)
+                        for d in ann.get("Deviation") or []
+                    ],
+                }
+            )
+
+    results.sort(key=lambda x: x["departure"])
+    return results
+
+
+def journey_item(journey):
+    """Turns a journey from route_journeys() into a scan result item."""
+    return {
+        "ticket": journey["ticket"],
+        "from": journey["from"],
+        "to": journey["to"],
+        "departureDate": journey["departure"].strftime("%Y-%m-%d"),
+        "departureTime": journey["departure"].strftime("%H:%M:%S"),
+        "canceled": journey["canceled"],
+        "delay": journey["delay"],
+        "ActivityType": journey["ActivityType"],
+    }
+
@@ -0,0 +1,386 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+PENDING = "pending"
+SUBMITTED = "submitted"
+FAILED = "failed"
+
+KEY_COLUMNS = (
+    "operator, claimant, from_station, to_station, departure_date, departure_time"
+)
+
+# Matches the row of one claim, with the values of ClaimLedger.key().
+KEY_WHERE = " AND ".join(f"{column.strip()} = ?" for column in KEY_COLUMNS.split(","))
+
+# Upstream responses are cut to this many characters in the attempt log.
+MAX_RESPONSE = 2000
+
+# Columns of the attempt log, in the order of ATTEMPT_FIELDS.
+ATTEMPT_COLUMNS = (
+    "id, operator, claimant, ticket, from_station, to_station, departure_date,"
+    " departure_time, status, http_status, response, error, duration, created"
+)
+
+ATTEMPT_FIELDS = (
+    "id",
+    "operator",
+    "claimant",
+    "ticket",
+    "from",
+    "to",
+    "departureDate",
+    "departureTime",
+    "status",
+    "httpStatus",
+    "response",
+    "error",
+    "duration",
+    "created",
+)
+
+
+class ClaimLedger:
+    """
+    Remembers which journeys have already been claimed, so that the same
+    journey is not filed twice with an operator.
+
+    Every attempt to file a claim is also appended to an attempt log together
+    with the upstream status code, response and timing. The log is never
+    updated, so it is the record of what was actually sent.
+
+    A claim is identified by operator, claimant, stations and departure date
+    and time: the same train can be claimed once by each traveller. The ticket
+    is not part of it, as it holds the train ident in scan results but the
+    commuter card number in batch mode and manual claims; the departure time
+    at a station already names the train. The claimant is a hash of the
+    customer's identity number, so the ledger does not hold the number itself.
+    Claims are reserved before they are sent, so two concurrent submissions of
+    the same journey cannot both go through; a reservation is released again
+    if the submission fails. Reservations remember the job and the run of the
+    job that made them, so that a job queued again after a restart can retry
+    the claims of its earlier run.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self._migrate()
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS claims (
+                operator TEXT,
+                claimant TEXT,
+                from_station TEXT,
+                to_station TEXT,
+                departure_date TEXT,
+                departure_time TEXT,
+                status TEXT,
+                created REAL,
+                job TEXT,
+                run TEXT,
+                PRIMARY KEY (
+                    operator, claimant, from_station, to_station,
+                    departure_date, departure_time
+                )
+            )
+            """
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS claims_status ON claims (status, created)"
+        )
+        self._copy_ticket_claims()
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS attempts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                operator TEXT,
+                claimant TEXT,
+                ticket TEXT,
+                from_station TEXT,
+                to_station TEXT,
+                departure_date TEXT,
+                departure_time TEXT,
+                status TEXT,
+                http_status INTEGER,
+                response TEXT,
+                error TEXT,
+                duration REAL,
+                created REAL
+            )
+            """
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS attempts_claim_key"
+            f" ON attempts ({KEY_COLUMNS}, status)"
+        )
+
+    def _migrate(self):
+        """
+        Ledgers written before claims were keyed by claimant cannot say who
+        filed each claim. Their claims are dropped so that nobody is blocked
+        by another traveller's claim; the attempt log is kept, with an empty
+        claimant. Claims keyed by ticket as well are moved over by
+        _copy_ticket_claims().
+        """
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(claims)")]
+        if columns and "claimant" not in columns:
+            self.db.execute("DROP TABLE claims")
+        elif "ticket" in columns:
+            self.db.execute("DROP INDEX IF EXISTS claims_status")
+            self.db.execute("ALTER TABLE claims RENAME TO ticket_claims")
+        elif columns:
+            for column in ("job", "run"):
+                if column not in columns:
+                    self.db.execute(f"ALTER TABLE claims ADD COLUMN {column} TEXT")
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(attempts)")]
+        if columns and "claimant" not in columns:
+            self.db.execute("ALTER TABLE attempts ADD COLUMN claimant TEXT DEFAULT ''")
+            self.db.execute("DROP INDEX IF EXISTS attempts_claim")
+        self.db.execute("DROP INDEX IF EXISTS attempts_key")
+
+    def _copy_ticket_claims(self):
+        """
+        Moves the claims of a ledger that keyed them by ticket as well into
+        the claims table. A journey claimed under several tickets becomes one
+        claim, submitted if any of them was.
+        """
+        tables = self.db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ticket_claims'"
+        ).fetchone()
+        if tables is None:
+            return
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.execute(
+                f"INSERT OR IGNORE INTO claims ({KEY_COLUMNS}, status, created)"
+                f" SELECT {KEY_COLUMNS}, status, created FROM ticket_claims"
+                " ORDER BY status = ? DESC",
+                (SUBMITTED,),
+            )
+            self.db.execute("DROP TABLE ticket_claims")
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def claimant(customer):
+        """Identifies the traveller filing a claim, see the class docstring."""
+        number = (customer or {}).get("identityNumber") or ""
+        number = "".join(c for c in str(number) if c.isalnum())
+        if not number:
+            return ""
+        return hashlib.sha256(number.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def key(cls, operator, item, customer=None):
+        return (
+            operator,
+            cls.claimant(customer),
+            item.get("from"),
+            item.get("to"),
+            item.get("departureDate"),
+            item.get("departureTime"),
+        )
+
+    def filed(self, operator, items, customer=None):
+        """
+        Returns, for each item, whether `customer` has already claimed it.
+        """
+        with self.lock:
+            return [
+                self.db.execute(
+                    f"SELECT 1 FROM claims WHERE {KEY_WHERE}",
+                    self.key(operator, item, customer),
+                ).fetchone()
+                is not None
+                for item in items
+            ]
+
+    def status(self, operator, item, customer=None):
+        """Returns the status of `customer`'s claim of the item, or None."""
+        with self.lock:
+            row = self.db.execute(
+                f"SELECT status FROM claims WHERE {KEY_WHERE}",
+                self.key(operator, item, customer),
+            ).fetchone()
+        return row[0] if row else None
+
+    def reserve(self, operator, item, customer=None, job=None, run=None):
+        """
+        Marks the item as being claimed by `customer` in run `run` of `job`.
+        Returns False if they already claimed or reserved it.
+
+        A claim left pending by an earlier run of the same job, which was
+        interrupted and is running again, is settled from the attempt log
+        instead: it is marked as submitted if an attempt went through, and
+        otherwise taken over so that the job can retry it. A claim reserved
+        by the current run is never taken over, so a job listing the same
+        journey twice files it once.
+        """
+        key = self.key(operator, item, customer)
+        now = time.time()
+        with self.lock:
+            if (
+                self.db.execute(
+                    f"INSERT OR IGNORE INTO claims ({KEY_COLUMNS}, status, created,"
+                    " job, run) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (*key, PENDING, now, job, run),
+                ).rowcount
+                == 1
+            ):
+                return True
+            if job is None or run is None:
+                return False
+
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                earlier_run = (
+                    f"{KEY_WHERE} AND status = ? AND job = ?"
+                    " AND (run IS NULL OR run != ?)"
+                )
+                self.db.execute(
+                    f"UPDATE claims SET status = ? WHERE {earlier_run}"
+                    f" AND EXISTS (SELECT 1 FROM attempts WHERE {KEY_WHERE}"
+                    " AND status = ?)",
+                    (SUBMITTED, *key, PENDING, job, run, *key, SUBMITTED),
+                )
+                taken = self.db.execute(
+                    f"UPDATE claims SET created = ?, run = ? WHERE {earlier_run}",
+                    (now, run, *key, PENDING, job, run),
+                ).rowcount
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+            return taken == 1
+
+    def confirm(self, operator, item, customer=None):
+        with self.lock:
+            self.db.execute(
+                f"UPDATE claims SET status = ? WHERE {KEY_WHERE}",
+                (SUBMITTED, *self.key(operator, item, customer)),
+            )
+
+    def release(self, operator, item, customer=None):
+        with self.lock:
+            self.db.execute(
+                f"DELETE FROM claims WHERE {KEY_WHERE}",
+                self.key(operator, item, customer),
+            )
+
+    def record_attempt(
+        self,
+        operator,
+        item,
+        status,
+        http_status=None,
+        response=None,
+        error=None,
+        duration=None,
+        customer=None,
+    ):
+        """Appends one attempt to file `item` to the attempt log."""
+        with self.lock:
+            self.db.execute(
+                f"INSERT INTO attempts ({KEY_COLUMNS}, ticket, status, http_status,"
+                " response, error, duration, created)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    *self.key(operator, item, customer),
+                    str(item.get("ticket")),
+                    status,
+                    http_status,
+                    response[:MAX_RESPONSE] if response else response,
+                    error,
+                    duration,
+                    time.time(),
+                ),
+            )
+
+    def reconcile(self, older_than, batch_size=1000, progress=None):
+        """
+        Settles claims left pending for more than `older_than` seconds, e.g. by
+        a worker that stopped while submitting. Claims with a successful
+        attempt in the log are marked as submitted; the others are released
+        so that they can be filed again. Works through the pending claims in
+        batches of `batch_size`, each in its own transaction, and calls
+        `progress(counts)` after each batch. Returns the counts.
+        """
+        cutoff = time.time() - older_than
+        counts = {"submitted": 0, "released": 0}
+        while True:
+            with self.lock:
+                self.db.execute("BEGIN IMMEDIATE")
+                try:
+                    rows = self.db.execute(
+                        "SELECT rowid FROM claims WHERE status = ? AND created < ?"
+                        " LIMIT ?",
+                        (PENDING, cutoff, batch_size),
+                    ).fetchall()
+                    if not rows:
+                        self.db.execute("COMMIT")
+                        break
+
+                    self.db.execute(
+                        "CREATE TEMP TABLE IF NOT EXISTS batch (id INTEGER)"
+                    )
+                    self.db.execute("DELETE FROM batch")
+                    self.db.executemany("INSERT INTO batch VALUES (?)", rows)
+                    submitted = self.db.execute(
+                        "UPDATE claims SET status = ?"
+                        " WHERE rowid IN (SELECT id FROM batch)"
+                        " AND EXISTS (SELECT 1 FROM attempts a"
+                        " WHERE a.operator = claims.operator"
+                        " AND a.claimant = claims.claimant"
+                        " AND a.from_station = claims.from_station"
+                        " AND a.to_station = claims.to_station"
+                        " AND a.departure_date = claims.departure_date"
+                        " AND a.departure_time = claims.departure_time"
+                        " AND a.status = ?)",
+                        (SUBMITTED, SUBMITTED),
+                    ).rowcount
+                    released = self.db.execute(
+                        "DELETE FROM claims WHERE rowid IN (SELECT id FROM batch)"
+                        " AND status = ?",
+                        (PENDING,),
+                    ).rowcount
+                    self.db.execute("COMMIT")
+                except Exception:
+                    self.db.execute("ROLLBACK")
+                    raise
+
+            counts["submitted"] += submitted
+            counts["released"] += released
+            if progress is not None:
+                progress(dict(counts))
+
+        return counts
+
+    def attempts(self, after=0, operator=None, batch_size=1000):
+        """
+        Yields the logged attempts with an id greater than `after`, oldest
+        first, as dicts with ATTEMPT_FIELDS. Rows are read in batches of
+        `batch_size`, so the lock is not held while the caller consumes them.
+        """
+        query = f"SELECT {ATTEMPT_COLUMNS} FROM attempts WHERE id > ?"
+        if operator is not None:
+            query += " AND operator = ?"
+        query += " ORDER BY id LIMIT ?"
+
+        while True:
+            params = (after, operator) if operator is not None else (after,)
+            with self.lock:
+                rows = self.db.execute(query, (*params, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(zip(ATTEMPT_FIELDS, row))
+            after = rows[-1][0]
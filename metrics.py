@@ -0,0 +1,174 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+SIZE_BUCKETS = [1000, 10000, 100000, 1000000, 10000000]
+
+_lock = threading.Lock()
+_metrics = {}
+_trace = threading.local()
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(key)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self.values[key] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # labels -> [bucket counts..., count above the last bucket, sum, count]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 3)
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_labels(key + (('le', bound),))} {cumulative}"
+                )
+            lines.append(f"{self.name}_bucket{_labels(key + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(key)} {series[-1]}")
+        return lines
+
+
+def counter(name, help):
+    with _lock:
+        return _metrics.setdefault(name, Counter(name, help))
+
+
+def gauge(name, help):
+    with _lock:
+        return _metrics.setdefault(name, Gauge(name, help))
+
+
+def histogram(name, help, buckets=LATENCY_BUCKETS):
+    with _lock:
+        return _metrics.setdefault(name, Histogram(name, help, buckets))
+
+
+def render():
+    """Returns all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in list(_metrics.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+operation_seconds = histogram(
+    "operation_duration_seconds", "Time spent in instrumented operations."
+)
+operation_errors = counter(
+    "operation_errors_total", "Instrumented operations that raised an exception."
+)
+
+
+@contextmanager
+def timed(operation):
+    """
+    Records how long the block takes in operation_duration_seconds, counts
+    exceptions in operation_errors_total and adds the timing to the current
+    trace.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        operation_errors.inc(operation=operation)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        operation_seconds.observe(elapsed, operation=operation)
+        record(operation, elapsed)
+
+
+def start_trace():
+    _trace.spans = []
+
+
+def record(name, elapsed):
+    """Adds a timing to the trace of the current thread, if one is active."""
+    spans = getattr(_trace, "spans", None)
+    if spans is not None:
+        spans.append((name, elapsed))
+
+
+def in_trace(fn):
+    """
+    Returns `fn` wrapped so that it records into the trace of the current
+    thread when called from another one, e.g. by a thread pool.
+    """
+    spans = getattr(_trace, "spans", None)
+    if spans is None:
+        return fn
+
+    def wrapper(*args, **kwargs):
+        previous = getattr(_trace, "spans", None)
+        _trace.spans = spans
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _trace.spans = previous
+
+    return wrapper
+
+
+def end_trace():
+    """Stops tracing the current thread and returns the recorded timings."""
+    spans = getattr(_trace, "spans", None) or []
+    _trace.spans = None
+    return spans
+
+
+def _labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in key) + "}"
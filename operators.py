@@ -1,27 +1,31 @@
-import requests
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cache
+import config
+import httpclient
+import metrics
+import stations
+
+# (departure station, arrival station, departure time) -> MT train number,
+# shared by all MT instances.
+train_numbers = cache.TTLCache(
+    config.train_number_cache_size,
+    config.train_number_cache_ttl,
+    os.path.join(config.data_dir, "cache.db")
+    if config.train_number_cache_persist
+    else None,
+    table="train_numbers",
+)
 
 
 class MT:
-    def __init__(self):
-        self.stations = {
-            "U": {"name": "Uppsala C", "id": "cf09cbb1-fd82-4b83-9c09-87bc8fc2f018"},
-            "Cst": {
-                "name": "Stockholm C",
-                "id": "f4d25596-a9f9-41a1-b200-713439d92fc4",
-            },
-            "Srv": {"name": "Storvreta", "id": "ddf64ca1-b3b3-4820-94fb-137f17fbefc3"},
-            "Fvk": {"name": "Furuvik", "id": "8751e52c-2214-4c1d-b64b-1d3eefc524b9"},
-            "Gä": {"name": "Gävle", "id": "c1ed2e95-5cc2-4e9d-a89b-fb27f01ad527"},
-            "Kn": {"name": "Knivsta", "id": "18df975c-61be-4029-94cd-fc565b0da4d9"},
-            "Mr": {"name": "Märsta", "id": "57d62e84-ab78-437f-bd59-7e5839de3ce4"},
-        }
-
     def submit(
         self, ticket, from_station, to_station, departure_date, departure_time, customer
     ):
-        r = requests.post(
-            "https://evf-regionsormland.preciocloudapp.net/api/Claims",
+        r = httpclient.post(
+            f"{config.mt_api_url}/Claims",
             json=self._create_request_body(
                 ticket,
                 from_station,
@@ -31,7 +35,9 @@ class MT:
             )
         )
 
-        return True
+        # A response is falsy for error statuses, which callers report as a
+        # failed claim together with the response text.
+        return r
 
     def _create_request_body(
         self, ticket, dep_station, arr_station, departure, customer
@@ -46,8 +52,8 @@ class MT:
             },
             "ticketNumber": ticket,
             "ticketType": 1,
-            "departureStationId": self.stations[dep_station]["id"],
-            "arrivalStationId": self.stations[arr_station]["id"],
+            "departureStationId": stations.registry.get(dep_station)["mt_id"],
+            "arrivalStationId": stations.registry.get(arr_station)["mt_id"],
             "departureDate": departure,
             "comment": "",
             "status": 0,
@@ -59,9 +65,45 @@ class MT:
             "claimReceipts": [],
         }
 
+    def prefetch_train_numbers(self, items):
+        """
+        Resolves the train numbers for a batch of items in parallel so that the
+        submissions that follow are served from the cache. Failures are ignored
+        here and reported when the item itself is submitted.
+        """
+        keys = {
+            (
+                item.get("from"),
+                item.get("to"),
+                self._get_fake_iso_string(
+                    item.get("departureDate"), item.get("departureTime")
+                ),
+            )
+            for item in items
+        }
+        missing = [k for k in keys if k not in train_numbers]
+        if not missing:
+            return
+
+        def resolve(key):
+            try:
+                self._get_train_number(*key)
+            except Exception:
+                pass
+
+        with ThreadPoolExecutor(
+            max_workers=min(config.submit_workers, len(missing))
+        ) as pool:
+            list(pool.map(metrics.in_trace(resolve), missing))
+
     def _get_train_number(self, departure_station, arrival_station, departure_time):
-        r = requests.get(
-            "https://evf-regionsormland.preciocloudapp.net/api/TrainStations/GetDistance",
+        key = (departure_station, arrival_station, departure_time)
+        train_number = train_numbers.get(key)
+        if train_number is not None:
+            return train_number
+
+        r = httpclient.get(
+            f"{config.mt_api_url}/TrainStations/GetDistance",
             params={
                 "departureStationId": departure_station,
                 "arrivalStationId": arrival_station,
@@ -69,43 +111,56 @@ class MT:
             },
         )
 
-        return r.json()["data"]["trafikverketTrainId"]
+        r.raise_for_status()
+        train_number = r.json()["data"]["trafikverketTrainId"]
+        train_numbers.set(key, train_number)
+
+        return train_number
 
     def _get_fake_iso_string(self, departure_date, departure_time):
         return f"{departure_date}T{departure_time}.000Z"
 
 
-class SJ:
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update(
-            {
-                "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0",
-                "Ocp-Apim-Subscription-Key": "78e7aad0e7b042b685d70e0131d897ca"
-            }
-        )
-        self.stations = {
-            "U": {"name": "Uppsala C", "id": "740000005"},
-            "Cst": {"name": "Stockholm Central", "id": "740000001"},
-            "Kn": {"name": "Knivsta", "id": "740000559"},
-            "Mr": {"name": "Märsta", "id": "740000027"},
-        }
+SJ_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0",
+    "Ocp-Apim-Subscription-Key": "78e7aad0e7b042b685d70e0131d897ca"
+}
 
+
+class SJ:
     def submit(
         self, ticket, from_station, to_station, departure_date, departure_time, customer
     ):
-        self._register_ticket(ticket)
-        self._add_travel_details(
+        # The compensation token is chained from one step to the next, so each
+        # claim keeps it in its own state and one instance can run many claims
+        # at the same time.
+        claim = _SJClaim()
+        claim.register_ticket(ticket)
+        claim.add_travel_details(
             from_station, to_station, departure_date, departure_time
         )
-        self._add_traveller_details(customer)
-        self._add_payout_details(customer["identityNumber"], customer["mobileNumber"])
+        claim.add_traveller_details(customer)
+        claim.add_payout_details(customer["identityNumber"], customer["mobileNumber"])
+
+        return claim.confirm()
 
-        return self._confirm()
 
-    def _register_ticket(self, ticket):
+# Shared instances. Neither keeps per-claim state, so one of each serves every
+# request and job instead of being constructed per submission.
+OPERATORS = {"mt": MT(), "sj": SJ()}
+
+
+class _SJClaim:
+    """State of a single SJ delay compensation claim."""
+
+    def __init__(self):
+        self.session = httpclient.new_session(SJ_HEADERS)
+        self.token = None
+        self.bar_id = None
+
+    def register_ticket(self, ticket):
         r = self.session.post(
-            "https://prod-api.adp.sj.se/public/delay-compensation/v1/compensation/delaycompensationtokens",
+            f"{config.sj_api_url}/delaycompensationtokens",
             data=json.dumps(
                 {
                     "commuterCardType": "Movingo 30 dgr på SJ kort",
@@ -115,21 +170,22 @@ class SJ:
             ).encode("utf-8"),
             headers={"Content-Type": "application/json; charset=UTF-8"},
         )
+        r.raise_for_status()
         self.token = r.json()["delayCompensationToken"]
 
-    def _add_travel_details(
+    def add_travel_details(
         self, from_station, to_station, departure_date, departure_time
     ):
         r = self.session.put(
-            f"https://prod-api.adp.sj.se/public/delay-compensation/v1/compensation/{self.token}/traveldetails",
+            f"{config.sj_api_url}/{self.token}/traveldetails",
             files={
                 "file": (
                     "data",
                     json.dumps(
                         {
                             "journeyDetail": {
-                                "departureLocation": self.stations[from_station],
-                                "arrivalLocation": self.stations[to_station],
+                                "departureLocation": self._location(from_station),
+                                "arrivalLocation": self._location(to_station),
                                 "journeyDate": {"date": departure_date},
                                 "journeyTime": {"time": departure_time[:5]},
                             },
@@ -141,11 +197,18 @@ class SJ:
                 )
             },
         )
+        r.raise_for_status()
         self.token = r.json()["delayCompensationToken"]
 
-    def _add_traveller_details(self, customer):
+    def _location(self, signature):
+        station = stations.registry.get(signature)
+        if station is None or "sj_id" not in station:
+            raise KeyError(f"SJ does not serve station {signature}")
+        return {"name": station["sj_name"], "id": station["sj_id"]}
+
+    def add_traveller_details(self, customer):
         r = self.session.put(
-            f"https://prod-api.adp.sj.se/public/delay-compensation/v1/compensation/{self.token}/contactinformation",
+            f"{config.sj_api_url}/{self.token}/contactinformation",
             data=json.dumps(
                 {
                     "emailAddress": customer["email"],
@@ -160,21 +223,23 @@ class SJ:
             ).encode("utf-8"),
             headers={"Content-Type": "application/json"},
         )
+        r.raise_for_status()
         self.token = r.json()["delayCompensationToken"]
 
-    def _add_payout_details(self, ssn, mobileNumber):
+    def add_payout_details(self, ssn, mobileNumber):
         r = self.session.post(
-            "https://prod-api.adp.sj.se/public/delay-compensation/v1/compensation/bankaccountrecords",
+            f"{config.sj_api_url}/bankaccountrecords",
             json={
                 "personalIdentityNumber": ssn,
                 "swishPhoneNumber": mobileNumber.replace("-", ""),
             },
         )
+        r.raise_for_status()
         self.bar_id = r.json()["barId"]
 
-    def _confirm(self):
+    def confirm(self):
         r = self.session.post(
-            f"https://prod-api.adp.sj.se/public/delay-compensation/v1/compensation/{self.token}/confirmations",
+            f"{config.sj_api_url}/{self.token}/confirmations",
             json={"paynovaBarIds": {"ticketCompensation": self.bar_id}},
         )
         return r
@@ -0,0 +1,126 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class ProfileStore:
+    """
+    Commuter profiles for batch mode: who travels which route on which ticket,
+    until when, and the customer details the operators need for a claim.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS profiles (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                operator TEXT,
+                ticket TEXT,
+                from_station TEXT,
+                to_station TEXT,
+                valid_until TEXT,
+                customer TEXT,
+                created REAL
+            )
+            """
+        )
+
+    def add(self, profile):
+        profile_id = uuid.uuid4().hex
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO profiles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    profile_id,
+                    profile["name"],
+                    profile["operator"],
+                    str(profile["ticket"]),
+                    profile["from"],
+                    profile["to"],
+                    profile["validUntil"],
+                    json.dumps(profile["customer"]),
+                    time.time(),
+                ),
+            )
+        return profile_id
+
+    def remove(self, profile_id):
+        with self.lock:
+            return (
+                self.db.execute(
+                    "DELETE FROM profiles WHERE id = ?", (profile_id,)
+                ).rowcount
+                == 1
+            )
+
+    def all(self):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, name, operator, ticket, from_station, to_station,"
+                " valid_until, customer FROM profiles ORDER BY created"
+            ).fetchall()
+
+        return [
+            {
+                "id": row[0],
+                "name": row[1],
+                "operator": row[2],
+                "ticket": row[3],
+                "from": row[4],
+                "to": row[5],
+                "validUntil": row[6],
+                "customer": json.loads(row[7]),
+            }
+            for row in rows
+        ]
+
+
+def routes(profiles):
+    """Returns the distinct routes travelled by the profiles."""
+    return sorted({tuple(sorted((p["from"], p["to"]))) for p in profiles})
+
+
+def fan_out(profiles, departures):
+    """
+    Matches delayed or cancelled journeys with the profiles travelling them,
+    in either direction, on a ticket valid on the day of the journey, if the
+    journey qualifies for compensation with the profile's operator.
+
+    Returns {profile id: [submission items]}, where each item carries the
+    profile's ticket.
+    """
+    by_route = {}
+    for profile in profiles:
+        by_route.setdefault(frozenset((profile["from"], profile["to"])), []).append(
+            profile
+        )
+
+    claims = {profile["id"]: [] for profile in profiles}
+    for dep in departures:
+        for profile in by_route.get(frozenset((dep["from"], dep["to"])), []):
+            tier = dep["tiers"].get(profile["operator"])
+            if not tier or dep["departureDate"] > profile["validUntil"]:
+                continue
+            claims[profile["id"]].append(
+                {
+                    "ticket": profile["ticket"],
+                    "train": dep["ticket"],
+                    "from": dep["from"],
+                    "to": dep["to"],
+                    "departureDate": dep["departureDate"],
+                    "departureTime": dep["departureTime"],
+                    "tier": tier,
+                }
+            )
+
+    return claims
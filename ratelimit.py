@@ -0,0 +1,132 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request to a host that is known to be down."""
+
+
+class _Host:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.failures = 0
+        self.circuit = CLOSED
+        self.opened_at = 0
+        self.trial_in_flight = False
+
+
+class RateLimiter:
+    """
+    Limits the requests sent to each upstream host.
+
+    Each host gets a token bucket that starts at `rate` requests per second
+    with bursts of up to `burst`. The rate is halved, down to `min_rate`,
+    whenever the host answers 429 or 5xx or the request fails, honouring any
+    Retry-After, and creeps back up while requests succeed.
+
+    After `failure_threshold` failures in a row the host's circuit opens and
+    requests fail at once with CircuitOpenError. After `cooldown` seconds one
+    trial request is let through; its outcome closes or reopens the circuit.
+
+    A rate of 0 disables the rate limit but keeps the circuit breaker.
+    """
+
+    def __init__(self, rate, burst=5, min_rate=0.2, failure_threshold=5, cooldown=30):
+        self.max_rate = rate
+        self.burst = max(burst, 1)
+        self.min_rate = min(min_rate, rate) if rate > 0 else 0
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def wait(self, url):
+        """
+        Blocks until a request to the host of `url` may be sent. Raises
+        CircuitOpenError if the host's circuit is open.
+        """
+        name = _hostname(url)
+        with self.lock:
+            host = self._host(name)
+            now = time.monotonic()
+
+            if host.circuit == OPEN:
+                if now - host.opened_at < self.cooldown:
+                    raise CircuitOpenError(f"{name} is unavailable, not sending requests")
+                host.circuit = HALF_OPEN
+                host.trial_in_flight = False
+            if host.circuit == HALF_OPEN:
+                if host.trial_in_flight:
+                    raise CircuitOpenError(f"{name} is unavailable, not sending requests")
+                host.trial_in_flight = True
+
+            if not host.rate:
+                return
+
+            # Take a token, going into debt if there is none; the debt is the
+            # time this caller has to wait.
+            host.tokens = min(self.burst, host.tokens + (now - host.updated) * host.rate)
+            host.updated = now
+            host.tokens -= 1
+            delay = -host.tokens / host.rate if host.tokens < 0 else 0
+
+        if delay:
+            time.sleep(delay)
+
+    def record(self, url, status=None, retry_after=None):
+        """
+        Records the outcome of a request: the response status, or None if the
+        request failed without a response.
+        """
+        name = _hostname(url)
+        failed = status is None or status == 429 or status >= 500
+        with self.lock:
+            host = self._host(name)
+            host.trial_in_flight = False
+
+            if not failed:
+                host.failures = 0
+                host.circuit = CLOSED
+                if host.rate:
+                    host.rate = min(self.max_rate, host.rate + self.max_rate / 10)
+                return
+
+            host.failures += 1
+            if host.rate:
+                host.rate = max(self.min_rate, host.rate / 2)
+                if retry_after:
+                    host.tokens = min(host.tokens, -retry_after * host.rate)
+            if host.circuit == HALF_OPEN or host.failures >= self.failure_threshold:
+                host.circuit = OPEN
+                host.opened_at = time.monotonic()
+
+    def state(self):
+        """Returns the current rate and circuit state of every host seen."""
+        with self.lock:
+            return {
+                name: {
+                    "rate": host.rate,
+                    "circuit": host.circuit,
+                    "failures": host.failures,
+                }
+                for name, host in self.hosts.items()
+            }
+
+    def _host(self, name):
+        host = self.hosts.get(name)
+        if host is None:
+            host = self.hosts[name] = _Host(self.max_rate, self.burst)
+        return host
+
+
+def _hostname(url):
+    return urlsplit(url).hostname or url
@@ -0,0 +1,110 @@
+import json
+
+# Conditions a rule may use. A rule matches a journey when all of its
+# conditions hold.
+CONDITIONS = ("canceled", "deviation", "delay_over")
+
+
+class EligibilityRules:
+    """
+    Decides which compensation tier, if any, a journey qualifies for with
+    each operator.
+
+    Rules are read from a JSON file mapping each operator to an ordered list
+    of rules, e.g.
+
+        {"mt": [{"tier": "cancelled", "canceled": true},
+                {"tier": "40 min", "delay_over": 40},
+                {"tier": "20 min", "delay_over": 20}]}
+
+    The first matching rule gives the tier. Conditions are "canceled" (true
+    or false), "deviation" (text found in a deviation of the departure or
+    arrival, e.g. "Buss ersätter") and "delay_over" (arrival delay in
+    minutes). Journeys are evaluated together, one array operation per rule.
+    """
+
+    def __init__(self, rules):
+        for operator, operator_rules in rules.items():
+            for rule in operator_rules:
+                unknown = set(rule) - set(CONDITIONS) - {"tier"}
+                if "tier" not in rule or unknown:
+                    raise ValueError(f"Invalid {operator} rule: {rule}")
+        self.rules = rules
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @property
+    def operators(self):
+        return list(self.rules)
+
+    def evaluate(self, journeys):
+        """
+        Returns {operator: [tier or None per journey]} for journeys as
+        returned by journeys.route_journeys().
+        """
+        # Imported here to keep NumPy off the app's startup path.
+        import numpy as np
+
+        n = len(journeys)
+        canceled = np.fromiter((j["canceled"] for j in journeys), dtype=bool, count=n)
+        delay = np.fromiter(
+            (np.nan if j["delay"] is None else j["delay"] for j in journeys),
+            dtype=float,
+            count=n,
+        )
+        deviations = (
+            np.array(["\n".join(j.get("deviations", [])) for j in journeys], dtype=str)
+            if n
+            else np.array([], dtype=str)
+        )
+        return {
+            operator: tiers.tolist()
+            for operator, tiers in self.evaluate_columns(
+                canceled, delay, deviations
+            ).items()
+        }
+
+    def evaluate_columns(self, canceled, delay, deviations=None):
+        """
+        Like evaluate(), for journeys given as arrays of canceled flags,
+        arrival delays (NaN if unknown) and deviation texts (joined by
+        newlines). Without deviations no "deviation" condition holds. Returns
+        {operator: object array of tiers}.
+        """
+        import numpy as np
+
+        n = len(canceled)
+        masks = {}
+
+        def condition(name, value):
+            if (name, value) not in masks:
+                if name == "canceled":
+                    mask = canceled == bool(value)
+                elif name == "deviation":
+                    mask = (
+                        np.char.find(deviations, value) >= 0
+                        if deviations is not None
+                        else np.zeros(n, dtype=bool)
+                    )
+                else:
+                    with np.errstate(invalid="ignore"):
+                        mask = delay > value
+                masks[name, value] = mask
+            return masks[name, value]
+
+        tiers = {}
+        for operator, operator_rules in self.rules.items():
+            result = np.full(n, None, dtype=object)
+            unmatched = np.ones(n, dtype=bool)
+            for rule in operator_rules:
+                mask = unmatched.copy()
+                for name in CONDITIONS:
+                    if name in rule:
+                        mask &= condition(name, rule[name])
+                result[mask] = rule["tier"]
+                unmatched &= ~mask
+            tiers[operator] = result
+        return tiers
@@ -0,0 +1,169 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+
+import hostlock
+import journeys
+
+
+class DelayScanner:
+    """
+    Runs `scan(routes, start_time, end_time)` in a background thread every
+    `interval` seconds over the last `window` and keeps the latest result, so
+    that requests on those routes can be answered without waiting on
+    Trafikverket.
+
+    `scan` must return items in the format of get_delayed_or_cancelled_routes().
+
+    If `path` is given, the latest result is also kept in an SQLite file so
+    that several processes on one host, e.g. gunicorn workers, share it. Only
+    the process holding the lock next to that file scans; the others answer
+    from the file and take over the scanning if that process goes away.
+    """
+
+    def __init__(self, scan, routes, interval, window, tz, path=None):
+        self.scan = scan
+        self.routes = list(routes)
+        # Routes are undirected, as in get_delayed_or_cancelled_routes().
+        self.covered = frozenset(frozenset(route) for route in self.routes)
+        self.interval = interval
+        self.window = window
+        self.tz = tz
+        self.lock = threading.Lock()
+        self.results = None
+        self.start_time = None
+        self.end_time = None
+        self.updated = 0
+        self.thread = None
+        self.stopped = threading.Event()
+        self.db = None
+        self.leader = None
+        self.leading = path is None
+
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(
+                path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS scan_results (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    start_time TEXT,
+                    end_time TEXT,
+                    results TEXT,
+                    updated REAL
+                )
+                """
+            )
+            self.leader = hostlock.HostLock(f"{path}.lock")
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self._run, name="delay-scanner", daemon=True
+            )
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run_once(self):
+        end_time = datetime.datetime.now(self.tz)
+        start_time = end_time - self.window
+        results = self.scan(self.routes, start_time, end_time)
+        updated = time.time()
+
+        with self.lock:
+            self.results = results
+            self.start_time = start_time
+            self.end_time = end_time
+            self.updated = updated
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO scan_results VALUES (1, ?, ?, ?, ?)",
+                    (
+                        start_time.isoformat(),
+                        end_time.isoformat(),
+                        json.dumps(results),
+                        updated,
+                    ),
+                )
+
+    def _refresh(self):
+        """Loads the shared result if another process stored a newer one."""
+        row = self.db.execute(
+            "SELECT updated FROM scan_results WHERE id = 1 AND updated > ?",
+            (self.updated,),
+        ).fetchone()
+        if row is None:
+            return
+
+        start_time, end_time, results, updated = self.db.execute(
+            "SELECT start_time, end_time, results, updated FROM scan_results"
+            " WHERE id = 1"
+        ).fetchone()
+        self.results = json.loads(results)
+        self.start_time = datetime.datetime.fromisoformat(start_time)
+        self.end_time = datetime.datetime.fromisoformat(end_time)
+        self.updated = updated
+
+    def lookup(self, routes, start_time, end_time):
+        """
+        Returns the precomputed items on `routes` departing between start_time
+        and end_time, or None if the last scan does not cover all of the
+        routes or that window. A window ending after the last scan is still
+        answered if it ends within one interval of it.
+        """
+        wanted = frozenset(frozenset(route) for route in routes)
+        if not wanted <= self.covered:
+            return None
+
+        with self.lock:
+            if self.db is not None:
+                self._refresh()
+            if self.results is None:
+                return None
+            if start_time < self.start_time or end_time > self.end_time + datetime.timedelta(
+                seconds=self.interval
+            ):
+                return None
+            results = self.results
+
+        # The scan itself looks past the end of the window, see
+        # get_delayed_or_cancelled_routes().
+        end_time = end_time + journeys.ARRIVAL_MARGIN
+        items = []
+        for item in results:
+            if frozenset((item["from"], item["to"])) not in wanted:
+                continue
+            departure = self.tz.localize(
+                datetime.datetime.strptime(
+                    f"{item['departureDate']} {item['departureTime']}",
+                    "%Y-%m-%d %H:%M:%S",
+                )
+            )
+            if start_time < departure < end_time:
+                items.append(item)
+
+        return items
+
+    def _run(self):
+        while not self.stopped.is_set():
+            started = time.monotonic()
+            if not self.leading:
+                # Another process scans; try again to take over next time.
+                self.leading = self.leader.acquire(blocking=False)
+                if not self.leading:
+                    self.stopped.wait(self.interval)
+                    continue
+            try:
+                self.run_once()
+            except Exception:
+                traceback.print_exc()
+            self.stopped.wait(max(0, self.interval - (time.monotonic() - started)))
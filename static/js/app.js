@@ -118,6 +118,12 @@ $("#paybackform").submit(function (e) {
     jsonData["customer"] = JSON.parse(localStorage.getItem("ticketholders"))[
       localStorage.getItem("ticketholder")
     ];
+    const failed = () =>
+      $("#result")
+        .attr("aria-busy", "false")
+        .attr("style", "color:red")
+        .text("Request failed");
+
     $.post({
       url: "/api/submit",
       contentType: "application/json",
@@ -127,12 +133,18 @@ $("#paybackform").submit(function (e) {
           .attr("style", "color:green")
           .attr("aria-busy", "true")
           .text(""),
-      success: (data) => $("#result").attr("aria-busy", "false").text(data),
-      error: () =>
-        $("#result")
-          .attr("aria-busy", "false")
-          .attr("style", "color:red")
-          .text("Request failed"),
+      success: (data) =>
+        pollJob(
+          data.job,
+          (result) => {
+            $("#result").attr("aria-busy", "false").text(result.message);
+            if (result.status !== "success") {
+              $("#result").attr("style", "color:red");
+            }
+          },
+          failed
+        ),
+      error: failed,
     });
   }
   e.preventDefault();
@@ -191,6 +203,24 @@ function loadTicketHolders(thObj) {
   });
 }
 
+// Polls a queued submission job until it has finished.
+function pollJob(jobId, onDone, onFail) {
+  $.get({
+    url: `/api/jobs/${jobId}`,
+    dataType: "json",
+    success: (job) => {
+      if (job.status === "done") {
+        onDone(job.result);
+      } else if (job.status === "failed") {
+        onFail(job.error);
+      } else {
+        setTimeout(() => pollJob(jobId, onDone, onFail), 1000);
+      }
+    },
+    error: (err) => onFail(err.responseText),
+  });
+}
+
 function loadDepartures() {
   $.get({
     url: `/api/departures/${$("#departureLocation").val()}/${$(
@@ -213,7 +243,37 @@ function loadDepartures() {
   });
 }
 
-$("#autoSubmit").click(() => {
+// Posts JSON to a streaming endpoint and calls onMessage for every line of
+// the newline-delimited JSON response as soon as it arrives.
+async function postNdjson(url, payload, onMessage) {
+  const response = await fetch(url, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(payload),
+  });
+  if (!response.ok) {
+    throw new Error(await response.text());
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) {
+      break;
+    }
+    buffer += decoder.decode(value, { stream: true });
+    let lines = buffer.split("\n");
+    buffer = lines.pop();
+    lines.filter((line) => line.trim()).forEach((line) => onMessage(JSON.parse(line)));
+  }
+  if (buffer.trim()) {
+    onMessage(JSON.parse(buffer));
+  }
+}
+
+$("#autoSubmit").click(async () => {
   // Read the auto date, start time, and Trafikverket API key inputs.
   let autoDate = $("#autoDate").val().trim();
   let startTime = $("#autoStartTime").val().trim();
@@ -226,10 +286,12 @@ $("#autoSubmit").click(() => {
     tvApiKey = localStorage.getItem("tv_api_key") || "";
   }
 
-  // Build the JSON payload.
+  // Build the JSON payload. Only the route picked above is scanned.
   let jsonData = { 
     startTime: startTime,
     date: autoDate,
+    from: $("#departureLocation").val(),
+    to: $("#arrivalLocation").val(),
     tv_api_key: tvApiKey
   };
 
@@ -238,75 +300,72 @@ $("#autoSubmit").click(() => {
     jsonData["customer"] = ticketholders[localStorage.getItem("ticketholder")];
   }
 
-  $("#autoResult")
-    .attr("aria-busy", "true")
-    .text("Submitting...");
-
-  $.ajax({
-    type: "POST",
-    url: "/api/auto_submit",
-    contentType: "application/json",
-    data: JSON.stringify(jsonData),
-    success: (data) => {
-      $("#autoResult").attr("aria-busy", "false").empty();
-      if (data.status === "success" && data.found > 0) {
-        $("#autoResult").text(data.message || "No result message found.");
-
-        // Store the items in autoItems array
-        autoItems = data.items;
-
-        let listContainer = $('<div id=listDiv></div>');
-
-        // Create a "Select All" checkbox
-        let selectAllCheckbox = $('<input type="checkbox" id="selectAll">');
-        let selectAllLabel = $('<label for="selectAll"> Select All</label>');
-        listContainer.append(selectAllCheckbox).append(selectAllLabel);
-        // Create a UL with id "submitList"
-        let list = $("<ul></ul>").attr("id", "submitList");
-      
-        data.items.forEach((item, idx) => {
-          // Each LI has the class "submitItem"
-          let li = $("<li></li>").addClass("submitItem");
-          let checkbox = $('<input type="checkbox" class="submission-item">').attr("data-index", idx);
-        
-          li.append(checkbox);
-          li.append(` Train ${item.ticket} from ${item.from} to ${item.to} scheduled at ${item.departureTime} ${item.departureDate} was ${item.status}`);
-          list.append(li);
-        });
-        listContainer.append(list)
-        $("#autoResult").append(listContainer);
-      
-        // Add a button to submit selected items.
-        let submitBtn = $('<button type="button" id="submitSelected">Submit selected</button>');
-        $("#autoResult").append(submitBtn);
-      
-        // Event listener for "Select All" functionality
-        selectAllCheckbox.on('click', function() {
-          $('.submission-item').prop('checked', this.checked);
-        });
-      
-        // If any individual checkbox is unchecked, uncheck the "Select All" checkbox
-        $('.submission-item').on('click', function() {
-          if (!$(this).prop('checked')) {
-            selectAllCheckbox.prop('checked', false);
-          } else if ($('.submission-item:checked').length === $('.submission-item').length) {
-            selectAllCheckbox.prop('checked', true);
-          }
-        });
-      } else {
-        $("#autoResult").text(data.message || "No delays or cancellations found.");
-      }
-    },
-    error: (err) => {
-      $("#autoResult")
-        .attr("aria-busy", "false")
-        .attr("style", "color:red")
-        .text("Request failed: " + err.responseText);
+  autoItems = [];
+
+  let message = $("<p></p>").attr("aria-busy", "true").text("Searching...");
+  let listContainer = $('<div id=listDiv></div>');
+
+  // Create a "Select All" checkbox
+  let selectAllCheckbox = $('<input type="checkbox" id="selectAll">');
+  let selectAllLabel = $('<label for="selectAll"> Select All</label>');
+  listContainer.append(selectAllCheckbox).append(selectAllLabel);
+  // Create a UL with id "submitList"
+  let list = $("<ul></ul>").attr("id", "submitList");
+  listContainer.append(list);
+
+  $("#autoResult").removeAttr("style").empty().append(message).append(listContainer.hide());
+
+  // Event listener for "Select All" functionality
+  selectAllCheckbox.on('click', function() {
+    $('.submission-item:enabled').prop('checked', this.checked);
+  });
+
+  // If any individual checkbox is unchecked, uncheck the "Select All" checkbox
+  list.on('click', '.submission-item', function() {
+    if (!$(this).prop('checked')) {
+      selectAllCheckbox.prop('checked', false);
+    } else if ($('.submission-item:checked').length === $('.submission-item:enabled').length) {
+      selectAllCheckbox.prop('checked', true);
     }
   });
+
+  try {
+    // Journeys are shown as soon as the server finds them.
+    await postNdjson("/api/auto_submit/stream", jsonData, (data) => {
+      if (data.type === "item") {
+        let item = data.item;
+        let idx = autoItems.push(item) - 1;
+
+        // Each LI has the class "submitItem"
+        let li = $("<li></li>").addClass("submitItem");
+        let checkbox = $('<input type="checkbox" class="submission-item">').attr("data-index", idx);
+        if (item.alreadySubmitted) {
+          checkbox.prop("disabled", true);
+        }
+
+        li.append(checkbox);
+        li.append(` Train ${item.ticket} from ${item.from} to ${item.to} scheduled at ${item.departureTime} ${item.departureDate} was ${item.status}`);
+        list.append(li);
+        listContainer.show();
+      } else if (data.type === "done") {
+        message.attr("aria-busy", "false").text(data.message || "No delays or cancellations found.");
+        if (data.found > 0) {
+          // Add a button to submit selected items.
+          $("#autoResult").append($('<button type="button" id="submitSelected">Submit selected</button>'));
+        }
+      } else if (data.type === "error") {
+        message.attr("aria-busy", "false").attr("style", "color:red").text(data.message);
+      }
+    });
+  } catch (err) {
+    $("#autoResult")
+      .attr("aria-busy", "false")
+      .attr("style", "color:red")
+      .text("Request failed: " + err.message);
+  }
 });
 
-$("#autoResult").on("click", "#submitSelected", () => {
+$("#autoResult").on("click", "#submitSelected", async () => {
   let selectedItems = [];
   $(".submission-item:checked").each(function () {
     let index = $(this).data("index");
@@ -324,21 +383,32 @@ $("#autoResult").on("click", "#submitSelected", () => {
     let ticketholders = JSON.parse(localStorage.getItem("ticketholders"));
     customer = ticketholders[localStorage.getItem("ticketholder")];
   }
-  
-  $.ajax({
-    type: "POST",
-    url: "/api/submit_selected",
-    contentType: "application/json",
-    data: JSON.stringify({ 
-      items: selectedItems,
-      customer: customer
-    }),
-    success: (data) => {
-      // Render the returned message in the #autoResult element.
-      $("#autoResult").html("<p style='color:green;'>" + data.message + "</p>");
-    },
-    error: (err) => {
-      $("#autoResult").html("<p style='color:red;'>Submission of selected items failed: " + err.responseText + "</p>");
-    }
-  });
-});
\ No newline at end of file
+
+  let message = $("<p aria-busy='true'></p>").text(`Submitting ${selectedItems.length} applications...`);
+  let list = $("<ul></ul>");
+  $("#autoResult").empty().append(message).append(list);
+
+  try {
+    // Each outcome is shown as soon as the claim has been submitted.
+    await postNdjson("/api/submit_selected/stream", { items: selectedItems, customer: customer }, (data) => {
+      if (data.type === "result") {
+        let outcome = data.result.submitted
+          ? "submitted"
+          : data.result.alreadySubmitted
+            ? "already submitted"
+            : data.result.duplicate
+              ? "listed twice, submitted once"
+              : `failed: ${data.result.error}`;
+        list.append($("<li></li>").text(`Train ${data.item.ticket} ${data.item.departureTime} ${data.item.departureDate}: ${outcome}`));
+      } else if (data.type === "done") {
+        // Render the returned message in the #autoResult element.
+        const color = data.status === "success" ? "green" : "red";
+        message.attr("aria-busy", "false").attr("style", `color:${color};`).text(data.message);
+      } else if (data.type === "error") {
+        message.attr("aria-busy", "false").attr("style", "color:red;").text("Submission of selected items failed: " + data.message);
+      }
+    });
+  } catch (err) {
+    $("#autoResult").html("<p style='color:red;'>Submission of selected items failed: " + err.message + "</p>");
+  }
+});
@@ -0,0 +1,184 @@
+import bisect
+import json
+import os
+import threading
+import time
+import traceback
+
+import config
+import httpclient
+
+# Stations offered in the form. These work without the full upstream list and
+# carry the SJ location ids, which only exist for the stations SJ serves.
+BUILTIN = {
+    "U": {
+        "name": "Uppsala C",
+        "mt_id": "cf09cbb1-fd82-4b83-9c09-87bc8fc2f018",
+        "sj_id": "740000005",
+        "sj_name": "Uppsala C",
+    },
+    "Cst": {
+        "name": "Stockholm C",
+        "mt_id": "f4d25596-a9f9-41a1-b200-713439d92fc4",
+        "sj_id": "740000001",
+        "sj_name": "Stockholm Central",
+    },
+    "Srv": {"name": "Storvreta", "mt_id": "ddf64ca1-b3b3-4820-94fb-137f17fbefc3"},
+    "Fvk": {"name": "Furuvik", "mt_id": "8751e52c-2214-4c1d-b64b-1d3eefc524b9"},
+    "Gä": {"name": "Gävle", "mt_id": "c1ed2e95-5cc2-4e9d-a89b-fb27f01ad527"},
+    "Kn": {
+        "name": "Knivsta",
+        "mt_id": "18df975c-61be-4029-94cd-fc565b0da4d9",
+        "sj_id": "740000559",
+        "sj_name": "Knivsta",
+    },
+    "Mr": {
+        "name": "Märsta",
+        "mt_id": "57d62e84-ab78-437f-bd59-7e5839de3ce4",
+        "sj_id": "740000027",
+        "sj_name": "Märsta",
+    },
+}
+
+# Seconds to wait before downloading the station list again after a failure,
+# doubled after each failure in a row up to the maximum.
+RETRY_MIN = 30
+RETRY_MAX = 3600
+
+
+class StationRegistry:
+    """
+    All stations, indexed by Trafikverket signature and name.
+
+    The built-in stations are always available. The full upstream station list
+    is downloaded the first time a station outside them is needed and cached
+    in `path` for `ttl` seconds, so each process fetches it at most once. If
+    the download fails, a stale cache is used meanwhile and the download is
+    tried again after a backoff.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.retry_at = 0
+        self.retry_delay = RETRY_MIN
+        self._index(BUILTIN)
+
+    def get(self, signature):
+        """Returns the station with the given signature, or None."""
+        station = self.by_signature.get(signature)
+        if station is None and not self.loaded:
+            self.load()
+            station = self.by_signature.get(signature)
+        return station
+
+    def name(self, signature):
+        station = self.get(signature)
+        return station["name"] if station else signature
+
+    def search(self, q, limit=20):
+        """
+        Returns up to `limit` stations whose name starts with `q`, ignoring
+        case, preceded by an exact signature match if there is one.
+        """
+        self.load()
+        q = q.strip().casefold()
+        if not q:
+            return []
+
+        results = []
+        exact = self.by_signature_folded.get(q)
+        if exact is not None:
+            results.append(exact)
+
+        i = bisect.bisect_left(self.names, (q,))
+        while i < len(self.names) and len(results) < limit:
+            name, signature = self.names[i]
+            if not name.startswith(q):
+                break
+            if self.by_signature[signature] not in results:
+                results.append(self.by_signature[signature])
+            i += 1
+
+        return results
+
+    def load(self):
+        with self.lock:
+            if self.loaded or time.time() < self.retry_at:
+                return
+            if not config.station_signature_field:
+                # Without the signatures the list cannot be indexed.
+                self.loaded = True
+                return
+
+            stations = self._read_cache(fresh=True)
+            if stations is None:
+                try:
+                    stations = self._fetch()
+                    self._write_cache(stations)
+                except Exception:
+                    traceback.print_exc()
+                    self.retry_at = time.time() + self.retry_delay
+                    self.retry_delay = min(self.retry_delay * 2, RETRY_MAX)
+                    stale = self._read_cache(fresh=False)
+                    if stale:
+                        self._index({**stale, **BUILTIN})
+                    return
+
+            # Built-in entries win, they carry the SJ ids.
+            self._index({**stations, **BUILTIN})
+            self.loaded = True
+            self.retry_delay = RETRY_MIN
+
+    def _index(self, stations):
+        by_signature = {
+            signature: {"signature": signature, **station}
+            for signature, station in stations.items()
+        }
+        self.by_signature = by_signature
+        self.by_signature_folded = {s.casefold(): v for s, v in by_signature.items()}
+        self.names = sorted(
+            (s["name"].casefold(), signature) for signature, s in by_signature.items()
+        )
+
+    def _fetch(self):
+        r = httpclient.get(f"{config.mt_api_url}/TrainStations")
+        r.raise_for_status()
+        data = r.json()
+        if isinstance(data, dict):
+            data = data.get("data", [])
+
+        field = config.station_signature_field
+        stations = {}
+        for raw in data:
+            signature = raw.get(field)
+            if signature and raw.get("name"):
+                stations[signature] = {"name": raw["name"], "mt_id": raw.get("id")}
+        # A list without signatures is not cached, so that the download is
+        # retried rather than leaving only the built-in stations.
+        if not stations:
+            raise ValueError(f"No station in the TrainStations list has a {field}")
+        return stations
+
+    def _read_cache(self, fresh):
+        try:
+            if fresh and time.time() - os.path.getmtime(self.path) > self.ttl:
+                return None
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_cache(self, stations):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(stations, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+registry = StationRegistry(
+    os.path.join(config.data_dir, "stations.json"), config.station_cache_ttl
+)
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# app.py opens its databases in DATA_DIR when it is imported, so point it at
+# a scratch directory before any test imports config.
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp())
+os.environ.setdefault("HOST_RATE_LIMIT", "0")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bench"))
@@ -0,0 +1,46 @@
+import datetime
+
+from analytics import DelayHistory
+from rules import EligibilityRules
+
+TZ = datetime.timezone(datetime.timedelta(hours=1))
+RULES = EligibilityRules({"mt": [{"tier": "cancelled", "canceled": True}]})
+STATIONS = ["U", "Kn", "Mr", "Cst"]
+
+
+def run(train, canceled=False, delay=0.0):
+    """Journeys of one train run for every station pair it covers."""
+    start = datetime.datetime(2026, 10, 1, 7, 0, tzinfo=TZ)
+    return [
+        {
+            "ticket": str(train),
+            "from": STATIONS[a],
+            "to": STATIONS[b],
+            "departure": start + datetime.timedelta(minutes=15 * a),
+            "canceled": canceled,
+            "delay": None if canceled else delay + b,
+        }
+        for a in range(len(STATIONS))
+        for b in range(a + 1, len(STATIONS))
+    ]
+
+
+def test_train_runs_are_counted_once(tmp_path):
+    history = DelayHistory(str(tmp_path), TZ)
+    history.record(run(100, canceled=True) + run(200, delay=10))
+    day = datetime.date(2026, 10, 1)
+
+    by_train = {r["key"]: r for r in history.stats(day, day, "train", RULES, "mt")}
+    assert by_train[100]["journeys"] == 1
+    assert by_train[100]["canceled"] == 1
+    assert by_train[100]["eligible"] == 1
+    assert by_train[200]["journeys"] == 1
+    assert by_train[200]["meanDelay"] == 13
+
+    (by_hour,) = history.stats(day, day, "hour", RULES, "mt")
+    assert by_hour["key"] == 7
+    assert by_hour["journeys"] == 2
+
+    by_route = history.stats(day, day, "route", RULES, "mt")
+    assert len(by_route) == 6
+    assert all(r["journeys"] == 2 for r in by_route)
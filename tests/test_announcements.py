@@ -0,0 +1,27 @@
+import datetime
+
+import pytz
+
+import announcements
+import config
+from mock_upstream import MockUpstream
+
+
+def test_small_query_limit_finds_every_announcement(tmp_path, monkeypatch):
+    server = MockUpstream(latency=0, trains=60).start()
+    monkeypatch.setattr(config, "tv_api_url", server.env()["TV_API_URL"])
+    tz = pytz.timezone("Europe/Stockholm")
+    stations = {"U", "Kn", "Mr", "Cst", "Srv", "Fvk", "Gä"}
+    start = tz.localize(datetime.datetime(2024, 3, 5))
+    end = start + datetime.timedelta(days=2)
+
+    found = {}
+    for limit in (1000, 7):
+        store = announcements.AnnouncementStore(
+            str(tmp_path / f"announcements-{limit}.db"), limit=limit
+        )
+        found[limit] = store.fetch("key", stations, start, end, tz)
+
+    assert len(found[1000]) > 100
+    assert found[7] == found[1000]
+    server.shutdown()
@@ -0,0 +1,17 @@
+import sqlite3
+
+import cache
+
+
+def test_file_drops_expired_and_surplus_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "PRUNE_INTERVAL", 0)
+    path = str(tmp_path / "cache.db")
+    c = cache.TTLCache(5, 100, path, table="t")
+    c.ttl = -1
+    c.set("expired", 1)
+    c.ttl = 100
+    for i in range(20):
+        c.set(i, i)
+
+    rows = sqlite3.connect(path).execute("SELECT key FROM t").fetchall()
+    assert sorted(int(key) for (key,) in rows) == [15, 16, 17, 18, 19]
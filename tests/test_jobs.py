@@ -0,0 +1,37 @@
+import sqlite3
+import time
+
+import jobs
+
+
+def wait_for(queue, job_id):
+    for _ in range(100):
+        job = queue.get(job_id)
+        if job["status"] in (jobs.DONE, jobs.FAILED):
+            return job
+        time.sleep(0.05)
+    raise AssertionError("job did not finish")
+
+
+def payloads(path):
+    with sqlite3.connect(path) as db:
+        return dict(db.execute("SELECT id, payload FROM jobs"))
+
+
+def test_finished_jobs_do_not_keep_their_payload(tmp_path):
+    path = str(tmp_path / "jobs.db")
+
+    def handler(payload, progress, job_id):
+        if payload["fail"]:
+            raise ValueError("failed")
+        return {"ok": True}
+
+    queue = jobs.JobQueue(path, handler, workers=1, poll_interval=0.05)
+    queue.start()
+    customer = {"identityNumber": "19900101-1234"}
+    done = queue.enqueue({"fail": False, "customer": customer})
+    failed = queue.enqueue({"fail": True, "customer": customer})
+
+    assert wait_for(queue, done)["result"] == {"ok": True}
+    assert wait_for(queue, failed)["error"] == "failed"
+    assert payloads(path) == {done: None, failed: None}
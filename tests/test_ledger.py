@@ -0,0 +1,83 @@
+import threading
+
+import batch
+from ledger import PENDING, ClaimLedger
+
+CUSTOMER = {"identityNumber": "19900101-1234"}
+ITEM = {
+    "ticket": "123",
+    "from": "U",
+    "to": "Cst",
+    "departureDate": "2026-10-01",
+    "departureTime": "07:12",
+}
+
+
+class FakeOperator:
+    def __init__(self):
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def submit(self, *args):
+        with self.lock:
+            self.calls += 1
+        return True
+
+
+def test_job_files_a_duplicated_item_once(tmp_path):
+    claims = ClaimLedger(str(tmp_path / "claims.db"))
+    op = FakeOperator()
+
+    results = batch.submit_items(
+        op, [ITEM, dict(ITEM)], CUSTOMER, ledger=claims, operator="mt", job="job1"
+    )
+
+    assert op.calls == 1
+    assert sum(1 for r in results if r["submitted"]) == 1
+    assert claims.status("mt", ITEM, CUSTOMER) == "submitted"
+
+
+def test_requeued_job_retries_its_pending_claim(tmp_path):
+    claims = ClaimLedger(str(tmp_path / "claims.db"))
+    # The first run of the job stopped after reserving the claim.
+    assert claims.reserve("mt", ITEM, CUSTOMER, job="job1", run="run1")
+    assert claims.status("mt", ITEM, CUSTOMER) == PENDING
+    op = FakeOperator()
+
+    other = batch.submit_items(
+        op, [ITEM], CUSTOMER, ledger=claims, operator="mt", job="job2"
+    )
+    results = batch.submit_items(
+        op, [ITEM], CUSTOMER, ledger=claims, operator="mt", job="job1"
+    )
+
+    assert not other[0]["submitted"]
+    assert results[0]["submitted"]
+    assert op.calls == 1
+    assert claims.status("mt", ITEM, CUSTOMER) == "submitted"
+
+
+def test_requeued_job_keeps_a_claim_that_went_through(tmp_path):
+    claims = ClaimLedger(str(tmp_path / "claims.db"))
+    assert claims.reserve("mt", ITEM, CUSTOMER, job="job1", run="run1")
+    claims.record_attempt("mt", ITEM, "submitted", customer=CUSTOMER)
+    op = FakeOperator()
+
+    results = batch.submit_items(
+        op, [ITEM], CUSTOMER, ledger=claims, operator="mt", job="job1"
+    )
+
+    assert op.calls == 0
+    assert results[0]["alreadySubmitted"]
+
+
+def test_claim_is_found_whatever_the_ticket_holds(tmp_path):
+    claims = ClaimLedger(str(tmp_path / "claims.db"))
+    # Scan results carry the train ident, batch items the commuter card.
+    assert claims.reserve("mt", ITEM, CUSTOMER)
+    claims.confirm("mt", ITEM, CUSTOMER)
+    card = dict(ITEM, ticket="4711", train=ITEM["ticket"])
+
+    assert claims.filed("mt", [card], CUSTOMER) == [True]
+    assert not claims.reserve("mt", card, CUSTOMER)
+    assert claims.filed("mt", [card], {"identityNumber": "19800101-0000"}) == [False]
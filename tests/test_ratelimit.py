@@ -0,0 +1,126 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import config
+import httpclient
+import ratelimit
+
+URL = "https://upstream.example/api"
+
+
+class Clock:
+    """Stands in for the time module, so that waiting takes no time."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    return clock
+
+
+def test_circuit_opens_after_failure_threshold(clock):
+    limiter = ratelimit.RateLimiter(0, failure_threshold=3, cooldown=30)
+    for _ in range(2):
+        limiter.wait(URL)
+        limiter.record(URL, 503)
+    limiter.wait(URL)
+    limiter.record(URL)
+
+    assert limiter.state()["upstream.example"]["circuit"] == ratelimit.OPEN
+    with pytest.raises(ratelimit.CircuitOpenError):
+        limiter.wait(URL)
+
+
+def open_circuit(limiter, clock):
+    limiter.wait(URL)
+    limiter.record(URL, 503)
+    clock.now += 30
+
+
+def test_one_trial_request_after_cooldown(clock):
+    limiter = ratelimit.RateLimiter(0, failure_threshold=1, cooldown=30)
+    open_circuit(limiter, clock)
+
+    limiter.wait(URL)
+    assert limiter.state()["upstream.example"]["circuit"] == ratelimit.HALF_OPEN
+    with pytest.raises(ratelimit.CircuitOpenError):
+        limiter.wait(URL)
+
+
+def test_failed_trial_reopens_the_circuit(clock):
+    limiter = ratelimit.RateLimiter(0, failure_threshold=1, cooldown=30)
+    open_circuit(limiter, clock)
+
+    limiter.wait(URL)
+    limiter.record(URL, 502)
+
+    assert limiter.state()["upstream.example"]["circuit"] == ratelimit.OPEN
+    with pytest.raises(ratelimit.CircuitOpenError):
+        limiter.wait(URL)
+
+
+def test_successful_trial_closes_the_circuit(clock):
+    limiter = ratelimit.RateLimiter(0, failure_threshold=1, cooldown=30)
+    open_circuit(limiter, clock)
+
+    limiter.wait(URL)
+    limiter.record(URL, 200)
+
+    assert limiter.state()["upstream.example"] == {
+        "rate": 0,
+        "circuit": ratelimit.CLOSED,
+        "failures": 0,
+    }
+    limiter.wait(URL)
+    limiter.wait(URL)
+
+
+def test_retry_after_holds_back_the_next_request(clock):
+    limiter = ratelimit.RateLimiter(10, burst=1, failure_threshold=5)
+    limiter.wait(URL)
+    limiter.record(URL, 429, retry_after=2)
+
+    limiter.wait(URL)
+
+    # Two seconds, and the spacing of the halved rate on top.
+    assert clock.slept == [pytest.approx(2 + 1 / 5)]
+
+
+class _Unavailable(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.calls += 1
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_unavailable_host_is_called_once_per_retry(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Unavailable)
+    server.calls = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(config, "http_retries", 3)
+    monkeypatch.setattr(config, "http_backoff", 0)
+    monkeypatch.setattr(httpclient, "limiter", ratelimit.RateLimiter(0))
+
+    r = httpclient.new_session().get(f"http://127.0.0.1:{server.server_address[1]}/")
+
+    assert r.status_code == 503
+    assert server.calls == 1 + config.http_retries
+    server.shutdown()
@@ -0,0 +1,49 @@
+import datetime
+
+import pytest
+
+import app
+import config
+from mock_upstream import MockUpstream
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    server = MockUpstream(latency=0).start()
+    monkeypatch.setattr(config, "tv_api_url", server.env()["TV_API_URL"])
+    yield server
+    server.shutdown()
+
+
+def journey_keys(departures):
+    return sorted(
+        (d["ticket"], d["from"], d["to"], d["departureDate"], d["departureTime"])
+        for d in departures
+    )
+
+
+@pytest.mark.parametrize("days", [1, 3])
+def test_stream_finds_the_journeys_of_a_plain_scan(upstream, days):
+    # Trains take an hour from U to Gä, so journeys late in the evening
+    # arrive on the next day.
+    routes = [("U", "Gä")]
+    start = app.tz.localize(datetime.datetime(2024, 3, 5))
+    end = start + datetime.timedelta(days=days)
+
+    plain = app.get_delayed_or_cancelled_routes(routes, start, end, "key")
+    streamed = [
+        d
+        for departures in app.iter_delayed_or_cancelled(routes, start, end, "key")
+        for d in departures
+    ]
+
+    assert plain
+    assert journey_keys(streamed) == journey_keys(plain)
+
+
+def test_form_scan_covers_the_picked_route():
+    _, routes, _, _ = app.read_scan_request(
+        {"tv_api_key": "key", "date": "2024-03-05", "from": "Kn", "to": "U"}
+    )
+
+    assert routes == [("Kn", "U")]
@@ -0,0 +1,29 @@
+import config
+import stations
+from mock_upstream import MockUpstream
+
+
+def test_registry_loads_the_upstream_list(tmp_path, monkeypatch):
+    server = MockUpstream(latency=0).start()
+    env = server.env()
+    monkeypatch.setattr(config, "mt_api_url", env["MT_API_URL"])
+    monkeypatch.setattr(config, "station_signature_field", env["STATION_SIGNATURE_FIELD"])
+    registry = stations.StationRegistry(str(tmp_path / "stations.json"), 3600)
+
+    assert registry.get("Sa")["name"] == "Sala"
+    # Built-in stations keep their SJ ids.
+    assert registry.get("U")["sj_id"] == "740000005"
+    assert [s["signature"] for s in registry.search("vä")] == ["Vå"]
+    server.shutdown()
+
+
+def test_registry_keeps_to_the_builtin_stations_without_a_signature_field(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setattr(config, "mt_api_url", "http://127.0.0.1:9/unreachable")
+    monkeypatch.setattr(config, "station_signature_field", "")
+    registry = stations.StationRegistry(str(tmp_path / "stations.json"), 3600)
+
+    assert registry.get("Sa") is None
+    assert registry.get("U")["name"] == "Uppsala C"
+    assert not (tmp_path / "stations.json").exists()
@@ -0,0 +1,32 @@
+import app
+import operators
+from ledger import ClaimLedger
+
+from .test_ledger import CUSTOMER, ITEM, FakeOperator
+
+
+class FakeMT(FakeOperator):
+    def prefetch_train_numbers(self, items):
+        pass
+
+
+def test_results_line_up_with_duplicated_items(tmp_path, monkeypatch):
+    op = FakeMT()
+    monkeypatch.setitem(operators.OPERATORS, "mt", op)
+    monkeypatch.setattr(app, "claim_ledger", ClaimLedger(str(tmp_path / "claims.db")))
+    other = dict(ITEM, ticket="456", departureTime="08:12")
+    progress = []
+
+    result = app.process_submission(
+        {"operator": "mt", "items": [ITEM, dict(ITEM), other], "customer": CUSTOMER},
+        progress.append,
+    )
+
+    assert op.calls == 2
+    assert [r["ticket"] for r in result["results"]] == ["123", "123", "456"]
+    assert [r["submitted"] for r in result["results"]] == [True, False, True]
+    assert result["results"][1]["duplicate"]
+    assert len(progress[-1]["results"]) == 3
+    assert result["message"] == (
+        "2 applications submitted. 1 were listed twice."
+    )